@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# download.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Download a 256 MB file from a local http.server, run in its own process
+# so its CPU is not counted, with the 1 KB iter_content loop downloads used
+# to have and with trackdownloader.download_file, and report MB/s and CPU
+# seconds per GB of each.
+#
+#   $ python3 benchmarks/download.py [megabytes]
+
+import os
+import sys
+import time
+import socket
+import resource
+import tempfile
+import subprocess
+
+CURRENTDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.normpath(os.path.join(CURRENTDIR, '../src')))
+
+from upodcatcher import httpclient  # noqa: E402
+from upodcatcher import trackdownloader  # noqa: E402
+
+MEGABYTES = 256
+RUNS = 3
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_server(port):
+    for index in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('the server did not start')
+
+
+def download_1k_chunks(url, local_filename):
+    r = httpclient.get(url, stream=True)
+    with open(local_filename, 'wb') as f:
+        for chunk in r.iter_content(chunk_size=1024):
+            if chunk:
+                f.write(chunk)
+
+
+def download_file(url, local_filename):
+    trackdownloader.download_file(url, local_filename)
+
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(function, url, local_filename):
+    best = None
+    for run in range(RUNS):
+        if os.path.exists(local_filename):
+            os.remove(local_filename)
+        start = time.perf_counter()
+        cpu = get_cpu_time()
+        function(url, local_filename)
+        ans = (time.perf_counter() - start, get_cpu_time() - cpu)
+        if best is None or ans[0] < best[0]:
+            best = ans
+    return best
+
+
+if __name__ == '__main__':
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else MEGABYTES
+    size = megabytes * 1024 * 1024
+    with tempfile.TemporaryDirectory() as directory:
+        served = os.path.join(directory, 'served')
+        os.makedirs(served)
+        with open(os.path.join(served, 'episode.mp3'), 'wb') as f:
+            f.write(os.urandom(size))
+        port = get_free_port()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'http.server', '--bind', '127.0.0.1',
+             '--directory', served, str(port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_server(port)
+            url = 'http://127.0.0.1:{0}/episode.mp3'.format(port)
+            local_filename = os.path.join(directory, 'episode.mp3')
+            for name, function in (('1 KB chunks', download_1k_chunks),
+                                   ('download_file', download_file)):
+                elapsed, cpu = measure(function, url, local_filename)
+                assert os.path.getsize(local_filename) == size
+                print('{0:>13}: {1:.0f} MB/s, {2:.2f} CPU s/GB'.format(
+                    name, megabytes / elapsed, cpu / size * 1024 ** 3))
+        finally:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ingest.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Ingest a 5,000 entries feed one INSERT at a time (as add_tracks used to)
+# and with DBManager.ingest_tracks, then ingest it again to time a no-op.
+#
+#   $ python3 benchmarks/ingest.py [number_of_entries]
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from email.utils import formatdate
+
+CURRENTDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.normpath(os.path.join(CURRENTDIR, '../src')))
+
+from upodcatcher.dbmanager import DBManager, get_entries  # noqa: E402
+
+ENTRIES = 5000
+
+
+def create_feed(number_of_entries):
+    items = []
+    for index in range(number_of_entries):
+        items.append('''<item>
+<guid>bench-{0}</guid>
+<title>Episode {0}</title>
+<link>http://example.com/{0}</link>
+<description>&lt;p&gt;Description of the episode {0}&lt;/p&gt;</description>
+<pubDate>{1}</pubDate>
+<enclosure url="http://example.com/{0}.mp3" length="1" type="audio/mpeg"/>
+</item>'''.format(index, formatdate(1500000000 - index * 3600)))
+    return '''<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Bench</title><link>http://example.com</link>
+<description>Bench</description>{0}</channel></rss>'''.format(
+        ''.join(items)).encode()
+
+
+def create_db(directory, name):
+    db = DBManager(True, os.path.join(directory, name))
+    db.execute('''INSERT INTO FEEDS(URL, TITLE, NORDER)
+ VALUES('http://example.com/feed', 'Bench', 1)''')
+    return db
+
+
+def ingest_one_by_one(db, feed_id, entries):
+    db.write(insert_one_by_one, db.get_max_norder('TRACKS'), feed_id,
+             entries)
+
+
+def insert_one_by_one(cursor, norder, feed_id, entries):
+    for entry in entries:
+        norder += 1
+        try:
+            cursor.execute('''INSERT INTO TRACKS(FEED_ID, IDEN, DATE, TITLE,
+ URL, LINK, DESCRIPTION, NORDER) VALUES(?, ?, ?, ?, ?, ?, ?, ?)''',
+                           (feed_id, entry['iden'], entry['date'],
+                            entry['title'], entry['url'], entry['link'],
+                            entry['description'], norder))
+        except sqlite3.IntegrityError:
+            pass
+
+
+def timeit(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    number_of_entries = int(sys.argv[1]) if len(sys.argv) > 1 else ENTRIES
+    content = create_feed(number_of_entries)
+    start = time.perf_counter()
+    entries = get_entries(content)
+    print('parse {0} entries: {1:.3f}s'.format(
+        len(entries), time.perf_counter() - start))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, function in (('one by one', ingest_one_by_one),
+                               ('ingest_tracks', None)):
+            db = create_db(directory, name.replace(' ', '_') + '.db')
+            if function is None:
+                function = db.ingest_tracks
+                args = (1, entries)
+            else:
+                args = (db, 1, entries)
+            first = timeit(function, *args)
+            second = timeit(function, *args)
+            print('{0:>14}: first {1:.3f}s, again {2:.3f}s'.format(
+                name, first, second))
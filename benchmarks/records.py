@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# records.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Load 100,000 track summaries and 100,000 full track rows as the dict based
+# Track classes and as the slotted records DBManager makes now, comparing
+# the time to build them, the memory they keep and the time to sort them.
+#
+#   $ python3 benchmarks/records.py [number_of_tracks]
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+CURRENTDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.normpath(os.path.join(CURRENTDIR, '../src')))
+
+from upodcatcher.dbmanager import DBManager  # noqa: E402
+from upodcatcher.dbmanager import TRACK_SUMMARY_COLUMNS  # noqa: E402
+from upodcatcher.upod_classes import Track, TrackSummary  # noqa: E402
+from upodcatcher.upod_classes import TrackRecord  # noqa: E402
+from upodcatcher.upod_classes import TrackSummaryRecord  # noqa: E402
+
+TRACKS = 100000
+SUMMARIES_SQL = '''SELECT {0} FROM TRACKS_FEED_VIEW WHERE FEED_ID=?
+ ORDER BY DATE DESC'''.format(TRACK_SUMMARY_COLUMNS)
+TRACKS_SQL = 'SELECT * FROM TRACKS_FEED_VIEW WHERE FEED_ID=?'
+
+
+def create_db(filename, number_of_tracks):
+    db = DBManager(True, filename)
+    feed_id = db.execute('''INSERT INTO FEEDS(URL, TITLE, NORDER)
+ VALUES('http://example.com/feed', 'Bench', 1)''')
+    db.ingest_tracks(feed_id, [{
+        'iden': 'bench-{0}'.format(index),
+        'date': '2017{0:06d}T000000'.format(index),
+        'title': 'Episode {0}'.format(index),
+        'url': 'http://example.com/{0}.mp3'.format(index),
+        'link': 'http://example.com/{0}'.format(index),
+        'description': 'Episode {0} description'.format(index)}
+        for index in range(number_of_tracks)])
+    return db, feed_id
+
+
+def load_summaries(db, feed_id):
+    cursor = db.db.cursor()
+    cursor.execute(SUMMARIES_SQL, (feed_id,))
+    ans = [TrackSummary(element, db.get_track_detail)
+           for element in cursor.fetchall()]
+    cursor.close()
+    return ans
+
+
+def load_summary_records(db, feed_id):
+    cursor = db.db.cursor()
+    cursor.row_factory = TrackSummaryRecord.row_factory(db.get_track_detail)
+    cursor.execute(SUMMARIES_SQL, (feed_id,))
+    ans = cursor.fetchall()
+    cursor.close()
+    return ans
+
+
+def load_tracks(db, feed_id):
+    cursor = db.db.cursor()
+    cursor.execute(TRACKS_SQL, (feed_id,))
+    ans = []
+    for element in cursor.fetchall():
+        track = Track()
+        track.set_from_tracks_feed_view(element)
+        ans.append(track)
+    cursor.close()
+    return ans
+
+
+def load_track_records(db, feed_id):
+    cursor = db.db.cursor()
+    cursor.row_factory = TrackRecord.row_factory()
+    cursor.execute(TRACKS_SQL, (feed_id,))
+    ans = cursor.fetchall()
+    cursor.close()
+    return ans
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    ans = function(*args)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    sorted(ans)
+    return ans, elapsed, current, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    number_of_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else TRACKS
+    with tempfile.TemporaryDirectory() as directory:
+        db, feed_id = create_db(os.path.join(directory, 'records.db'),
+                                number_of_tracks)
+        # Warm the page cache so the first one measured is not penalized
+        load_track_records(db, feed_id)
+        for name, function in (('summaries', load_summaries),
+                               ('summary records', load_summary_records),
+                               ('tracks', load_tracks),
+                               ('track records', load_track_records)):
+            tracks, elapsed, current, sorting = measure(function, db, feed_id)
+            print('{0:>15}: {1} in {2:.3f}s, {3:.1f} MB kept, '
+                  'sorted in {4:.3f}s'.format(name, len(tracks), elapsed,
+                                              current / 1024 / 1024, sorting))
+            del tracks
+        db.close()
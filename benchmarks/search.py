@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# search.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Time DBManager.search_tracks on a library of 200 feeds with 1,000 tracks
+# each, whose titles and descriptions are drawn from a 5,000 words
+# vocabulary with a Zipf-like distribution, so some words match most of
+# the library and others a handful of tracks. The last column is the cost
+# of ranking every match instead of the newest SEARCH_CANDIDATES.
+#
+#   $ python3 benchmarks/search.py [number_of_tracks]
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+CURRENTDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.normpath(os.path.join(CURRENTDIR, '../src')))
+
+from upodcatcher.dbmanager import DBManager  # noqa: E402
+
+TRACKS = 200000
+TRACKS_PER_FEED = 1000
+VOCABULARY = 5000
+DESCRIPTION_WORDS = 60
+RUNS = 20
+QUERIES = ['w1', 'w2 w3', 'w49', 'w1234', 'w4999 w1', 'podcast 7']
+
+
+def get_words(generator, number_of_words):
+    return ' '.join('w{0}'.format(int(generator.paretovariate(1.0)) %
+                                  VOCABULARY)
+                    for index in range(number_of_words))
+
+
+def create_db(filename, number_of_tracks):
+    generator = random.Random(0)
+    db = DBManager(True, filename)
+    for feed in range(number_of_tracks // TRACKS_PER_FEED):
+        feed_id = db.execute('''INSERT INTO FEEDS(URL, TITLE, NORDER)
+ VALUES(?, ?, ?)''', ('http://example.com/{0}'.format(feed),
+                      'Podcast {0}'.format(feed), feed))
+        entries = []
+        for index in range(TRACKS_PER_FEED):
+            iden = '{0}-{1}'.format(feed, index)
+            entries.append({
+                'iden': iden,
+                'date': '2017{0:04d}T000000'.format(index),
+                'title': get_words(generator, 6),
+                'url': 'http://example.com/{0}.mp3'.format(iden),
+                'link': '',
+                'description': get_words(generator, DESCRIPTION_WORDS)})
+        db.ingest_tracks(feed_id, entries)
+    return db
+
+
+if __name__ == '__main__':
+    number_of_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else TRACKS
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        db = create_db(os.path.join(directory, 'search.db'), number_of_tracks)
+        print('{0} tracks indexed in {1:.1f}s'.format(
+            number_of_tracks, time.perf_counter() - start))
+        for query in QUERIES:
+            times = []
+            for run in range(RUNS):
+                start = time.perf_counter()
+                tracks = db.search_tracks(query, 50)
+                times.append(time.perf_counter() - start)
+            times.sort()
+            start = time.perf_counter()
+            db.search_tracks(query, 50, newest=None)
+            every = time.perf_counter() - start
+            print('{0:>10}: {1:2d} results, median {2:.1f}ms, '
+                  'worst {3:.1f}ms, ranking every match {4:.1f}ms'.format(
+                      query, len(tracks), times[len(times) // 2] * 1000,
+                      times[-1] * 1000, every * 1000))
+        db.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# tracks.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Open a 5,000 tracks feed with 2 KB descriptions and 100 KB of artwork
+# loading full rows from TRACKS_FEED_VIEW (as get_tracks_from_feed used
+# to) and loading the summaries that get_tracks_from_feed returns now.
+#
+#   $ python3 benchmarks/tracks.py [number_of_tracks]
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+CURRENTDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.normpath(os.path.join(CURRENTDIR, '../src')))
+
+from upodcatcher.dbmanager import DBManager  # noqa: E402
+from upodcatcher.upod_classes import Track  # noqa: E402
+
+TRACKS = 5000
+DESCRIPTION_SIZE = 2 * 1024
+IMAGE_SIZE = 100 * 1024
+
+
+def create_db(filename, number_of_tracks):
+    db = DBManager(True, filename)
+    feed_id = db.execute('''INSERT INTO FEEDS(URL, TITLE, IMAGE, NORDER)
+ VALUES('http://example.com/feed', 'Bench', ?, 1)''', ('A' * IMAGE_SIZE,))
+    db.ingest_tracks(feed_id, [{
+        'iden': 'bench-{0}'.format(index),
+        'date': '2017{0:04d}T000000'.format(index),
+        'title': 'Episode {0}'.format(index),
+        'url': 'http://example.com/{0}.mp3'.format(index),
+        'link': 'http://example.com/{0}'.format(index),
+        'description': 'x' * DESCRIPTION_SIZE}
+        for index in range(number_of_tracks)])
+    return db, feed_id
+
+
+def get_full_tracks(db, feed_id):
+    cursor = db.db.cursor()
+    cursor.execute('''SELECT * FROM TRACKS_FEED_VIEW WHERE FEED_ID=?
+ ORDER BY DATE DESC''', (feed_id,))
+    ans = []
+    for element in cursor.fetchall():
+        track = Track()
+        track.set_from_tracks_feed_view(element)
+        ans.append(track)
+    cursor.close()
+    return ans
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    ans = function(*args)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ans, elapsed, current, peak
+
+
+if __name__ == '__main__':
+    number_of_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else TRACKS
+    with tempfile.TemporaryDirectory() as directory:
+        db, feed_id = create_db(os.path.join(directory, 'tracks.db'),
+                                number_of_tracks)
+        for name, function, args in (
+                ('full rows', get_full_tracks, (db, feed_id)),
+                ('summaries', db.get_tracks_from_feed, (feed_id,))):
+            tracks, elapsed, current, peak = measure(function, *args)
+            print('{0:>10}: {1} tracks in {2:.3f}s, {3:.1f} MB kept, '
+                  '{4:.1f} MB peak'.format(name, len(tracks), elapsed,
+                                           current / 1024 / 1024,
+                                           peak / 1024 / 1024))
+            del tracks
+        tracks = db.get_tracks_from_feed(feed_id)
+        start = time.perf_counter()
+        description = tracks[0]['description']
+        print('    detail: {0} bytes loaded on demand in {1:.3f}ms'.format(
+            len(description), (time.perf_counter() - start) * 1000))
+        db.close()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# cli.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Headless entry point for cron and scripts. It must only import the
+# database and network layers, never Gtk or GdkPixbuf.
+
+import os
+import sys
+import json
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import comun
+from . import ratelimiter
+from .dbmanager import DBManager
+from .feedrefresher import FeedRefresher, MAX_WORKERS
+from .opmlparser import create_opml_from_urls, extract_rss_urls_from_opml
+from .trackdownloader import download_track
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+DOWNLOAD_JOBS = 2
+
+
+def get_duration(filename):
+    try:
+        import mutagen
+        return mutagen.File(filename).info.length
+    except Exception as e:
+        print('---', e, '---')
+    return 0
+
+
+def refresh(db, args):
+    feeds = db.get_feeds()
+    if args.feed is not None:
+        feeds = [feed for feed in feeds if feed['id'] in args.feed]
+    results = []
+    for feed_id, new_tracks, unlistened, error in FeedRefresher(
+            db, max_workers=args.jobs).refresh(feeds):
+        results.append({'feed_id': feed_id,
+                        'new_tracks': new_tracks,
+                        'unlistened': unlistened,
+                        'error': error})
+    failed = any(result['error'] is not None for result in results)
+    return results, EXIT_FAILED if failed else EXIT_OK
+
+
+def get_tracks_to_download(db, args):
+    if args.track:
+        return [db.get_track(id) for id in args.track]
+    tracks = []
+    for feed in db.get_feeds():
+        if args.feed is not None and feed['id'] not in args.feed:
+            continue
+        pending = [track for track in db.get_tracks_from_feed(feed['id'])
+                   if track['downloaded'] == 0 and track['listened'] == 0]
+        tracks.extend(pending[:args.new])
+    return tracks
+
+
+def download(db, args):
+    results = []
+    tracks = [track for track in get_tracks_to_download(db, args)
+              if track is not None and track['id'] != -1]
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {}
+        for track in tracks:
+            futures[executor.submit(download_track, track)] = track
+        for future in as_completed(futures):
+            track = futures[future]
+            result = {'track_id': track['id'], 'filename': None,
+                      'error': None}
+            try:
+                filename = future.result()
+                db.set_track_downloaded(track['id'], filename)
+                db.set_track_duration(track['id'], get_duration(
+                    os.path.join(comun.PODCASTS_DIR, filename)))
+                result['filename'] = filename
+            except Exception as e:
+                result['error'] = str(e)
+            results.append(result)
+    failed = any(result['error'] is not None for result in results)
+    return results, EXIT_FAILED if failed else EXIT_OK
+
+
+def list_feeds_or_tracks(db, args):
+    results = []
+    if args.feed is None:
+        counters = db.get_feed_counters()
+        for feed in db.get_feeds():
+            counter = counters.get(feed['id'], {})
+            results.append({
+                'id': feed['id'],
+                'title': feed['title'],
+                'url': feed['url'],
+                'unlistened': counter.get('unlistened', 0),
+                'downloaded': counter.get('downloaded', 0),
+                'total': counter.get('total', 0)})
+    else:
+        for feed_id in args.feed:
+            for track in db.get_tracks_from_feed(feed_id):
+                results.append({'id': track['id'],
+                                'feed_id': track['feed_id'],
+                                'date': track['date'],
+                                'title': track['title'],
+                                'url': track['url'],
+                                'downloaded': track['downloaded'],
+                                'listened': track['listened'],
+                                'filename': track['filename']})
+    return results, EXIT_OK
+
+
+def import_opml(db, args):
+    results = []
+    with open(args.filename, 'r') as f:
+        urls = extract_rss_urls_from_opml(f.read())
+    for url in urls:
+        result = {'url': url, 'feed_id': db.get_feed_id(url), 'error': None}
+        if result['feed_id'] is None:
+            try:
+                result['feed_id'] = db.add_feed(url)
+                if result['feed_id'] is None:
+                    result['error'] = 'unable to add {0}'.format(url)
+                else:
+                    db.sync_feed(result['feed_id'])
+            except Exception as e:
+                result['error'] = str(e)
+        results.append(result)
+    failed = any(result['error'] is not None for result in results)
+    return results, EXIT_FAILED if failed else EXIT_OK
+
+
+def export_opml(db, args):
+    opmlstring = create_opml_from_urls([feed['url']
+                                        for feed in db.get_feeds()])
+    if args.filename is None:
+        return opmlstring, EXIT_OK
+    with open(args.filename, 'w') as f:
+        f.write(opmlstring)
+    return {'filename': args.filename}, EXIT_OK
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='upodcatcher-cli',
+        description='{0} {1} without the graphical interface'.format(
+            comun.APPNAME, comun.VERSION))
+    parser.add_argument('--json', action='store_true',
+                        help='write the result as json')
+    parser.add_argument('--limit-rate', type=int, metavar='KB/S',
+                        help='limit the bandwidth used (0 for no limit)')
+    parser.add_argument('--limit-background', type=int, metavar='KB/S',
+                        help='limit the bandwidth of the feed fetches '
+                        '(0 for no limit)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    aparser = subparsers.add_parser('refresh', help='refresh the feeds')
+    aparser.add_argument('--feed', type=int, action='append',
+                         help='feed id (all the feeds by default)')
+    aparser.add_argument('--jobs', type=int, default=MAX_WORKERS,
+                         help='number of feeds fetched at the same time')
+    aparser.set_defaults(function=refresh)
+
+    aparser = subparsers.add_parser('download', help='download tracks')
+    aparser.add_argument('track', type=int, nargs='*',
+                         help='track id (the newest tracks by default)')
+    aparser.add_argument('--feed', type=int, action='append',
+                         help='only the newest tracks of this feed')
+    aparser.add_argument('--new', type=int, default=1,
+                         help='newest not listened tracks per feed')
+    aparser.add_argument('--jobs', type=int, default=DOWNLOAD_JOBS,
+                         help='number of downloads at the same time')
+    aparser.set_defaults(function=download)
+
+    aparser = subparsers.add_parser('list', help='list feeds or tracks')
+    aparser.add_argument('--feed', type=int, action='append',
+                         help='list the tracks of this feed')
+    aparser.set_defaults(function=list_feeds_or_tracks)
+
+    aparser = subparsers.add_parser('import-opml', help='import an opml')
+    aparser.add_argument('filename')
+    aparser.set_defaults(function=import_opml)
+
+    aparser = subparsers.add_parser('export-opml', help='export an opml')
+    aparser.add_argument('filename', nargs='?')
+    aparser.set_defaults(function=export_opml)
+    return parser
+
+
+def print_results(results, as_json):
+    if as_json:
+        print(json.dumps(results, indent=2))
+    elif isinstance(results, str):
+        print(results)
+    elif isinstance(results, dict):
+        print(' '.join('{0}={1}'.format(key, value)
+                       for key, value in results.items()))
+    else:
+        for result in results:
+            print('\t'.join(str(value) for value in result.values()))
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.limit_rate is not None or args.limit_background is not None:
+        ratelimiter.set_limits(
+            None if args.limit_rate is None else args.limit_rate * 1024,
+            None if args.limit_background is None else
+            args.limit_background * 1024)
+    # The database layer still prints its traces, keep stdout for the result
+    with contextlib.redirect_stdout(sys.stderr):
+        db = DBManager(False)
+        results, exit_code = args.function(db, args)
+        db.close()
+    print_results(results, args.json)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -57,7 +57,8 @@ APPNAME = 'uPodcatcher'
 CONFIG_DIR = os.path.join(os.path.expanduser('~'), '.config')
 CONFIG_APP_DIR = os.path.join(CONFIG_DIR, APP)
 PODCASTS_DIR = os.path.join(CONFIG_APP_DIR, 'podcasts')
-THUMBNAILS_DIR = os.path.join(CONFIG_APP_DIR, 'thumbnails')
+FEEDS_CACHE_DIR = os.path.join(CONFIG_APP_DIR, 'feeds_cache')
+IMAGES_DIR = os.path.join(CONFIG_APP_DIR, 'images')
 CONFIG_FILE = os.path.join(CONFIG_APP_DIR, APPCONF)
 DATABASE = os.path.join(CONFIG_APP_DIR, 'feeds.db')
 AUTOSTART_DIR = os.path.join(CONFIG_DIR, 'autostart')
@@ -67,8 +68,10 @@ if not os.path.exists(CONFIG_APP_DIR):
     os.makedirs(CONFIG_APP_DIR)
 if not os.path.exists(PODCASTS_DIR):
     os.makedirs(PODCASTS_DIR)
-if not os.path.exists(THUMBNAILS_DIR):
-    os.makedirs(THUMBNAILS_DIR)
+if not os.path.exists(FEEDS_CACHE_DIR):
+    os.makedirs(FEEDS_CACHE_DIR)
+if not os.path.exists(IMAGES_DIR):
+    os.makedirs(IMAGES_DIR)
 
 if is_package():
     ROOTDIR = '/usr/share/'
@@ -23,22 +23,57 @@
 
 import sqlite3
 from . import comun
-import requests
+from . import httpclient
+from . import ratelimiter
+from . import streamparser
+from .dbtracer import get_tracer
+from .dbwriter import DBWriter, connect
+from .feedcache import FeedCache
+from .imagestore import ImageStore
+from .migrations import migrate
+from .streamparser import get_entries
 import feedparser
-import io
 import os
-import base64
-from PIL import Image
-from dateutil.parser import parse
-from .upod_classes import Feed, Track
+import hashlib
+import time
+import threading
+from .upod_classes import FeedRecord, TrackRecord, TrackSummaryRecord
+
+# What the track view renders, without descriptions. The artwork is only
+# the hash of the image in the store.
+TRACK_SUMMARY_COLUMNS = '''ID, FEED_ID, DATE, TITLE, URL, DURATION, POSITION,
+ DOWNLOADED, LISTENED, FILENAME, NORDER, PODCAST_NAME, PODCAST_IMAGE'''
+
+# Markers around the matched words in the snippets of search_tracks
+SNIPPET_START = '<b>'
+SNIPPET_END = '</b>'
+SNIPPET_TOKENS = 16
+# How many of the newest matches search_tracks ranks by default. Ranking
+# with bm25 costs more the more tracks match, and a word found in every
+# track should cost about the same as a rare one.
+SEARCH_CANDIDATES = 2000
+
+# Tracks per page of the keyset paginated listings
+TRACKS_PAGE_SIZE = 100
+
+# Seconds a buffered position, duration or listened update may wait in
+# memory, which is also what can be lost if the application crashes.
+FLUSH_INTERVAL = 5
+# The buffered columns the track listings show. In the list views POSITION
+# and LISTENED are the ones of LIST, so only DURATION comes from TRACKS.
+PENDING_COLUMNS = ('DURATION', 'POSITION', 'LISTENED')
+PENDING_LIST_COLUMNS = ('DURATION',)
 
 SQLStartString = '''
 DROP TABLE if exists FEEDS;
 DROP TABLE if exists LISTS;
 DROP TABLE if exists TRACKS;
 DROP TABLE if exists LIST;
+DROP TABLE if exists FEED_COUNTERS;
+DROP TABLE if exists TRACKS_FTS;
 DROP VIEW if exists TRACKS_FEED_VIEW;
 DROP VIEW if exists TRACKS_LIST_VIEW;
+PRAGMA user_version=0;
 '''
 
 SQLString = '''
@@ -49,7 +84,13 @@ CREATE TABLE if not exists FEEDS (
     IMAGE TEXT,
     LINK TEXT DEFAULT '',
     DESCRIPTION TEXT DEFAULT '',
-    NORDER INTEGER);
+    NORDER INTEGER,
+    ETAG TEXT,
+    LAST_MODIFIED TEXT,
+    BODY_HASH TEXT,
+    LAST_CHECKED INTEGER,
+    IMAGE_HASH TEXT,
+    IMAGE_URL TEXT);
 CREATE TABLE if not exists LISTS (
     ID INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE NOT NULL,
     NAME TEXT UNIQUE NOT NULL,
@@ -95,7 +136,7 @@ CREATE VIEW if not exists TRACKS_FEED_VIEW AS
         TRACKS.FILENAME,
         TRACKS.NORDER,
         FEEDS.TITLE AS PODCAST_NAME,
-        FEEDS.IMAGE AS PODCAST_IMAGE
+        FEEDS.IMAGE_HASH AS PODCAST_IMAGE
       FROM TRACKS
       LEFT JOIN FEEDS ON TRACKS.FEED_ID = FEEDS.ID
       ORDER BY TRACKS.NORDER;
@@ -117,7 +158,7 @@ CREATE VIEW if not exists TRACKS_LIST_VIEW AS
         TRACKS.FILENAME,
         LIST.NORDER,
         FEEDS.TITLE AS PODCAST_NAME,
-        FEEDS.IMAGE AS PODCAST_IMAGE,
+        FEEDS.IMAGE_HASH AS PODCAST_IMAGE,
         LIST.LIST_ID AS LIST_ID
     FROM LIST
     LEFT JOIN LISTS ON LIST.LIST_ID = LISTS.ID
@@ -129,218 +170,553 @@ CREATE VIEW if not exists TRACKS_LIST_VIEW AS
 INSERT OR IGNORE INTO LISTS (NAME, NORDER) VALUES ('All', 1);
 '''
 
+SQLUpsertTrack = '''
+INSERT INTO TRACKS(FEED_ID, IDEN, DATE, TITLE, URL, LINK, DESCRIPTION, NORDER)
+    VALUES(?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(IDEN) DO UPDATE SET
+        DATE=excluded.DATE,
+        TITLE=excluded.TITLE,
+        URL=excluded.URL,
+        LINK=excluded.LINK,
+        DESCRIPTION=excluded.DESCRIPTION
+    WHERE TRACKS.FEED_ID=excluded.FEED_ID;
+'''
+
 
-def create_base64(image_url):
-    base64string = None
-    print(image_url)
-    try:
-        r = requests.get(image_url, timeout=5, verify=False)
-        if r.status_code == 200:
-            writer_file = io.BytesIO()
-            for chunk in r.iter_content(1024):
-                writer_file.write(chunk)
-            old_image = Image.open(writer_file)
-            old_image.thumbnail((128, 128), Image.ANTIALIAS)
-            new_image = io.BytesIO()
-            old_image.save(new_image, "png")
-            base64string = base64.b64encode(new_image.getvalue())
-    except Exception as e:
-        print(e)
-    if base64string is not None:
-        return base64string.decode()
-    return None
+def download_feed(feed, cache=None):
+    headers = {}
+    if feed['etag']:
+        headers['If-None-Match'] = feed['etag']
+    if feed['last_modified']:
+        headers['If-Modified-Since'] = feed['last_modified']
+    r = httpclient.get(feed['url'], headers=headers, verify=False,
+                       stream=True)
+    if r.status_code != 200:
+        r.close()
+    if r.status_code == 304:
+        if cache is not None:
+            cache.touch(feed['url'])
+        return None, {'etag': feed['etag'],
+                      'last_modified': feed['last_modified'],
+                      'body_hash': feed['body_hash']}
+    if r.status_code == 200:
+        # Feed fetches count as background traffic
+        content = b''.join(ratelimiter.iter_content(r, background=True))
+        validators = {'etag': r.headers.get('ETag'),
+                      'last_modified': r.headers.get('Last-Modified'),
+                      'body_hash': hashlib.sha1(content).hexdigest()}
+        if cache is not None:
+            cache.put(feed['url'], content, validators)
+        if validators['body_hash'] == feed['body_hash']:
+            return None, validators
+        return content, validators
+    return None, None
+
+
+def fetch_feed(feed, cache=None, refresh=False):
+    '''
+    Conditional GET of the feed. Returns (content, validators): content is
+    the raw body, or None when the server answers 304, the body hash has not
+    changed or the request failed. validators holds the ETAG, LAST_MODIFIED
+    and BODY_HASH to store once the tracks have been saved (None on failure).
+
+    With a cache, a body fetched less than cache.ttl seconds ago is served
+    without touching the network, and one up to cache.stale seconds older is
+    served while it is revalidated in the background. An explicit refresh
+    skips both and always sends the conditional GET, the body it gets is
+    still cached.
+    '''
+    if cache is not None and not refresh:
+        cached = cache.get(feed['url'])
+        if cached is not None and cache.is_usable(cached):
+            if not cache.is_fresh(cached):
+                cache.revalidate(feed['url'], download_feed, feed, cache)
+            validators = {'etag': cached['etag'],
+                          'last_modified': cached['last_modified'],
+                          'body_hash': cached['body_hash']}
+            if cached['body_hash'] == feed['body_hash']:
+                return None, validators
+            content = cache.get_content(feed['url'])
+            if content is not None:
+                return content, validators
+    return download_feed(feed, cache)
+
+
+def get_last_entry_date(entries):
+    last_date = None
+    for entry in entries:
+        if last_date is None or last_date < entry['date']:
+            last_date = entry['date']
+    return last_date
+
+
+def count_new_entries(entries, upperthan=None):
+    new_tracks = 0
+    for entry in entries:
+        if upperthan is None or upperthan < entry['date']:
+            new_tracks += 1
+    return new_tracks
+
+
+def get_fts_query(text):
+    '''
+    Turn what the user typed into an FTS5 query that matches tracks having
+    all the words, the last one as a prefix, whatever punctuation or FTS5
+    syntax the text contains.
+    '''
+    words = [word.replace('"', '""') for word in text.split()]
+    if len(words) == 0:
+        return None
+    words = ['"{0}"'.format(word) for word in words]
+    words[-1] += '*'
+    return ' '.join(words)
+
+
+def select_max_norder(cursor, table):
+    cursor.execute('''SELECT max(NORDER) FROM {0}'''.format(table))
+    ans = cursor.fetchone()[0]
+    if ans is None:
+        return 0
+    return ans
+
+
+def select_max_norder_in_list(cursor, list_id):
+    cursor.execute('''SELECT max(NORDER) FROM LIST WHERE LIST_ID=?''',
+                   (list_id,))
+    ans = cursor.fetchone()[0]
+    if ans is None:
+        return 0
+    return ans
+
+
+def create_schema(cursor, restart=False):
+    if restart is True:
+        # Dropping the tables must not cascade into the ones already dropped
+        cursor.execute('PRAGMA foreign_keys=OFF')
+        cursor.executescript(SQLStartString)
+        cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.executescript(SQLString)
+    migrate(cursor.connection)
 
 
 class DBManager():
-    def __init__(self, restart=False):
+    '''
+    The database is in WAL mode. Every write goes through a single DBWriter
+    thread that owns the write connection, while each thread reads through
+    its own connection (self.db), so reads never wait for a refresh
+    transaction to finish.
+    '''
+    def __init__(self, restart=False, database=comun.DATABASE):
         if not os.path.exists(comun.CONFIG_APP_DIR):
             os.makedirs(comun.CONFIG_APP_DIR)
-        if not os.path.exists(comun.DATABASE):
+        if not os.path.exists(database):
             restart = True
-        self.db = sqlite3.connect(comun.DATABASE, check_same_thread=False)
+        self.database = database
+        self.readers = threading.local()
+        self.cache = FeedCache()
+        self.images = ImageStore()
+        self.tracer = get_tracer()
+        self.writer = DBWriter(database, tracer=self.tracer)
+        cursor = self.writer.db.cursor()
+        create_schema(cursor, restart)
+        cursor.close()
+        self.writer.start()
+        self.pending = {}
+        self.flushing = {}
+        self.pending_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flush_timer = None
+        if self.tracer is not None:
+            self.tracer.instrument(self, exclude=('close',))
+
+    @property
+    def db(self):
+        '''
+        The read connection of the calling thread.
+        '''
+        db = getattr(self.readers, 'db', None)
+        if db is None:
+            db = connect(self.database, readonly=True, tracer=self.tracer)
+            self.readers.db = db
+        return db
+
+    def write(self, function, *args):
+        '''
+        Run function(cursor, *args) in the writer thread and wait until it
+        is committed. Returns what function returns or raises what it
+        raises.
+        '''
+        return self.writer.submit(function, *args).result()
+
+    def execute(self, sql, parameters=()):
+        def execute_in_writer(cursor):
+            cursor.execute(sql, parameters)
+            return cursor.lastrowid
+
+        return self.write(execute_in_writer)
+
+    def buffer_track_update(self, id, column, value):
+        '''
+        Keep the last value of column for the track in memory, it is written
+        by the next flush, at most FLUSH_INTERVAL seconds later. Until then
+        the reads merge it into the tracks they return.
+        '''
+        with self.pending_lock:
+            self.pending.setdefault(id, {})[column] = value
+            self.start_flush_timer()
+
+    def start_flush_timer(self):
+        '''
+        Flush in FLUSH_INTERVAL seconds unless a flush is already due. The
+        caller holds pending_lock.
+        '''
+        if self.flush_timer is None and not self.writer.stopped:
+            self.flush_timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def flush(self):
+        '''
+        Write all the buffered track updates in a single transaction. If the
+        write fails they go back to the buffer, behind any newer value, and
+        are tried again by the next flush.
+        '''
+        with self.flush_lock:
+            with self.pending_lock:
+                pending = self.pending
+                self.pending = {}
+                self.flushing = pending
+                if self.flush_timer is not None:
+                    self.flush_timer.cancel()
+                    self.flush_timer = None
+            if len(pending) == 0:
+                return
+
+            def update_tracks(cursor):
+                for id, values in pending.items():
+                    columns = sorted(values.keys())
+                    cursor.execute('UPDATE TRACKS SET {0} WHERE ID=?'.format(
+                        ', '.join(column + '=?' for column in columns)),
+                        [values[column] for column in columns] + [id])
+
+            try:
+                self.write(update_tracks)
+            except Exception as e:
+                print('---', e, '---')
+                with self.pending_lock:
+                    for id, values in pending.items():
+                        newer = self.pending.setdefault(id, {})
+                        for column, value in values.items():
+                            newer.setdefault(column, value)
+                    self.start_flush_timer()
+            with self.pending_lock:
+                self.flushing = {}
+
+    def get_pending(self):
+        '''
+        Return the buffered track updates that are not committed yet,
+        including the ones being flushed, as a dict id -> {column: value}.
+        '''
+        with self.pending_lock:
+            if len(self.pending) == 0 and len(self.flushing) == 0:
+                return {}
+            ans = {}
+            for updates in (self.flushing, self.pending):
+                for id, values in updates.items():
+                    ans.setdefault(id, {}).update(values)
+        return ans
+
+    def merge_pending(self, tracks, columns=PENDING_COLUMNS):
+        '''
+        Overwrite the columns of the tracks just read with the buffered
+        updates, so reads see them without waiting for a flush.
+        '''
+        pending = self.get_pending()
+        if len(pending) == 0:
+            return tracks
+        for track in tracks:
+            if track is not None and track['id'] in pending:
+                for column, value in pending[track['id']].items():
+                    if column in columns:
+                        track[column.lower()] = value
+        return tracks
+
+    def get_pending_unlistened(self):
+        '''
+        Return how much the buffered listened updates change the unlistened
+        counter of each feed, as a dict feed_id -> difference.
+        '''
+        listened = {}
+        for id, values in self.get_pending().items():
+            if 'LISTENED' in values:
+                listened[id] = values['LISTENED']
+        ans = {}
+        if len(listened) == 0:
+            return ans
+        ids = list(listened.keys())
         cursor = self.db.cursor()
-        if restart is True:
-            cursor.executescript(SQLStartString)
-        cursor.executescript(SQLString)
-        self.db.commit()
+        try:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                cursor.execute('''SELECT ID, FEED_ID, LISTENED FROM TRACKS
+ WHERE ID IN ({0})'''.format(', '.join('?' * len(chunk))), chunk)
+                for id, feed_id, stored in cursor.fetchall():
+                    if (stored == 0) != (listened[id] == 0):
+                        ans[feed_id] = ans.get(feed_id, 0) + (
+                            1 if listened[id] == 0 else -1)
+        except sqlite3.OperationalError as e:
+            print('---', e, '---')
+        cursor.close()
+        return ans
+
+    def close(self):
+        self.flush()
+        self.writer.stop()
+        if self.tracer is not None:
+            self.tracer.dump()
 
     def restart(self):
-        cursor = self.db.cursor()
-        cursor.executescript(SQLStartString)
-        cursor.executescript(SQLString)
-        self.db.commit()
+        with self.pending_lock:
+            self.pending = {}
+        self.writer.submit(create_schema, True, exclusive=True).result()
 
     def remove_feed(self, id):
-        cursor = self.db.cursor()
         ans = False
         try:
-            cursor.execute(
-                '''PRAGMA foreign_keys=ON;''')
-            cursor.execute(
-                '''DELETE FROM FEEDS WHERE ID=?''', (id,))
-            self.db.commit()
+            self.execute('''DELETE FROM FEEDS WHERE ID=?''', (id,))
             ans = True
         except Exception as e:
             print('---', e, '---')
-        cursor.close()
+        if ans:
+            self.sweep_images()
         return ans
 
+    def sweep_images(self):
+        '''
+        Remove the artwork no feed refers to from the image store.
+        '''
+        cursor = self.db.cursor()
+        try:
+            cursor.execute('''SELECT DISTINCT IMAGE_HASH FROM FEEDS
+ WHERE IMAGE_HASH IS NOT NULL''')
+            keep = set(row[0] for row in cursor.fetchall())
+        except sqlite3.OperationalError as e:
+            print('---', e, '---')
+            cursor.close()
+            return 0
+        cursor.close()
+        return self.images.sweep(keep)
+
     def add_feed(self, url):
         ans = None
-        r = requests.get(url, verify=False)
+        r = httpclient.get(url, verify=False)
         if r.status_code == 200:
             d = feedparser.parse(r.text)
             title = d.feed.title
             image_url = d.feed.image.url
-            image = create_base64(image_url)
+            image_hash = self.images.download(image_url)
             link = d.feed.link
             description = d.feed.description
-            norder = self.get_max_norder('FEEDS')
-            cursor = self.db.cursor()
+
+            def insert_feed(cursor):
+                norder = select_max_norder(cursor, 'FEEDS') + 1
+                cursor.execute('''INSERT INTO FEEDS(URL, TITLE, LINK,
+ DESCRIPTION, NORDER, IMAGE_HASH, IMAGE_URL) VALUES(?, ?, ?, ?, ?, ?, ?)''',
+                               (url, title, link, description, norder,
+                                image_hash, image_url))
+                return cursor.lastrowid
+
             try:
-                norder += 1
-                cursor.execute('''INSERT INTO FEEDS(URL, TITLE, IMAGE, LINK,
- DESCRIPTION, NORDER) VALUES(?, ?, ?, ?, ?, ?)''', (url, title, image, link,
-                                                    description, norder))
-                self.db.commit()
-                ans = cursor.lastrowid
+                ans = self.write(insert_feed)
             except sqlite3.IntegrityError as e:
                 print('---', e, '---')
-            cursor.close()
         return ans
 
-    def get_last_track_date(self, feed_id):
-        feed = self.get_feed(feed_id)
-        if feed is None:
-            return None
-        url = feed['url']
-        print(url)
-        last_date = None
-        r = requests.get(url, verify=False)
-        if r.status_code == 200:
-            d = feedparser.parse(r.text)
-            for index, entry in enumerate(d.entries):
-                new_date = parse(entry.published).strftime('%Y%m%dT%H%M%S')
-                print(new_date)
-                if last_date is None or last_date < new_date:
-                    last_date = new_date
-        return last_date
-
-    def get_new_tracks(self, feed_id, upperthan=None):
-        new_tracks = 0
+    def add_tracks(self, feed_id, upperthan=None):
         feed = self.get_feed(feed_id)
         if feed is None:
-            return 0
-        url = feed['url']
-        r = requests.get(url, verify=False)
-        if r.status_code == 200:
-            d = feedparser.parse(r.text)
-            for index, entry in enumerate(d.entries):
-                date = parse(entry.published).strftime('%Y%m%dT%H%M%S')
-                if upperthan is None or upperthan < date:
-                    new_tracks += 1
-            return new_tracks
-        return 0
+            return
+        content, validators = fetch_feed(feed, self.cache)
+        entries = [entry for entry in get_entries(content)
+                   if upperthan is None or upperthan < entry['date']]
+        result = self.ingest_tracks(feed_id, entries)
+        self.set_feed_validators(feed_id, validators)
+        return result['inserted']
 
-    def add_tracks(self, feed_id, upperthan=None):
+    def sync_feed(self, feed_id, fetched=None,
+                  stop_after=streamparser.STOP_AFTER):
+        '''
+        Fetch the feed once (unless fetched, the (content, validators) pair
+        returned by fetch_feed, is given), parse it once and bring TRACKS
+        in line with it. Returns a dict with the counts of inserted, updated
+        and unchanged tracks, the number of new_tracks newer than the last
+        stored track, the last_date of the feed and an error message (None
+        when the feed could be fetched).
+
+        When the feed already has tracks it is streamed and parsing stops
+        after stop_after consecutive entries that are already known; feeds
+        that are not sorted by date are fully parsed. Set stop_after to None
+        to always parse the whole feed.
+        '''
+        result = {'feed_id': feed_id, 'changed': False, 'inserted': 0,
+                  'updated': 0, 'unchanged': 0, 'new_tracks': 0,
+                  'last_date': None, 'error': None}
         feed = self.get_feed(feed_id)
         if feed is None:
-            return
-        url = feed['url']
-        print('---', feed, '---')
-        r = requests.get(url, verify=False)
-        if r.status_code == 200:
-            d = feedparser.parse(r.text)
-            title = d.feed.title
-            cursor = self.db.cursor()
-            norder = self.get_max_norder('TRACKS')
-            norder2 = self.get_max_norder_in_list(1)
-            for index, entry in enumerate(d.entries):
-                print('=============================')
-                print(entry)
-                print(entry.itunes_duration)
-                print(entry.id)
-                print('=============================')
+            result['error'] = 'unknown feed'
+            return result
+        if fetched is None:
+            fetched = fetch_feed(feed, self.cache)
+        content, validators = fetched
+        upperthan = self.get_last_track_from_feed(feed_id)['date']
+        result['last_date'] = upperthan
+        if content is not None:
+            entries = None
+            if upperthan is not None and stop_after:
+                entries = streamparser.get_new_entries(content, upperthan,
+                                                       stop_after)
+            if entries is None:
+                entries = get_entries(content)
+            result.update(self.ingest_tracks(feed_id, entries))
+            result['changed'] = True
+            result['new_tracks'] = count_new_entries(entries, upperthan)
+            result['last_date'] = get_last_entry_date(entries) or upperthan
+        if validators is None:
+            result['error'] = 'unable to fetch {0}'.format(feed['url'])
+        self.set_feed_validators(feed_id, validators)
+        self.set_feed_checked(feed_id)
+        return result
+
+    def ingest_tracks(self, feed_id, entries):
+        '''
+        Bulk ingest the entries of a feed. Entries already stored for the
+        feed with the same values are filtered out in Python, the rest are
+        upserted with a single executemany in one transaction, so changed
+        titles or enclosures are updated in place.
+        '''
+        return self.write(self.ingest_tracks_in_writer, feed_id, entries)
+
+    def ingest_tracks_in_writer(self, cursor, feed_id, entries):
+        ans = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        cursor.execute('''SELECT IDEN, DATE, TITLE, URL, LINK, DESCRIPTION
+ FROM TRACKS WHERE FEED_ID=?''', (feed_id,))
+        known = {}
+        for row in cursor.fetchall():
+            known[row[0]] = tuple(row[1:])
+        others = self.get_idens_in_other_feeds(
+            feed_id, [entry['iden'] for entry in entries
+                      if entry['iden'] not in known], cursor)
+        norder = select_max_norder(cursor, 'TRACKS')
+        kinds = []
+        rows = []
+        for entry in entries:
+            values = (entry['date'], entry['title'], entry['url'],
+                      entry['link'], entry['description'])
+            if entry['iden'] in others:
+                continue
+            if entry['iden'] not in known:
                 norder += 1
-                norder2 += 1
-                print(index)
-                iden = entry.id
-                date = parse(entry.published).strftime('%Y%m%dT%H%M%S')
-                title = entry.title
-                url = entry.enclosures[0]['url']
-                link = entry.link
-                description = entry.description
-                filename = None
-                duration = 0
-                position = 0
-                if upperthan is None or upperthan < date:
-                    try:
-                        cursor.execute('''INSERT INTO TRACKS(FEED_ID, IDEN,
- DATE, TITLE, URL, LINK, DESCRIPTION, DURATION, POSITION, FILENAME, NORDER)
- VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                                       (feed_id, iden, date, title, url, link,
-                                        description, duration, position,
-                                        filename, norder))
-                        track_id = cursor.lastrowid
-                    except Exception as e:
-                        print('---', e, '---')
-            self.db.commit()
-            cursor.close()
-            return track_id
-        return None
+                kinds.append('inserted')
+            elif known[entry['iden']] != values:
+                kinds.append('updated')
+            else:
+                ans['unchanged'] += 1
+                continue
+            known[entry['iden']] = values
+            rows.append((feed_id, entry['iden']) + values + (norder,))
+        cursor.execute('SAVEPOINT ingest')
+        try:
+            cursor.executemany(SQLUpsertTrack, rows)
+            for kind in kinds:
+                ans[kind] += 1
+        except sqlite3.IntegrityError as e:
+            # Another feed already has one of the enclosures. Roll back
+            # and go row by row to keep the rest.
+            print('---', e, '---')
+            cursor.execute('ROLLBACK TO ingest')
+            for kind, row in zip(kinds, rows):
+                try:
+                    cursor.execute(SQLUpsertTrack, row)
+                    ans[kind] += 1
+                except sqlite3.IntegrityError as e:
+                    print('---', e, '---')
+        cursor.execute('RELEASE ingest')
+        return ans
 
-    def set_track_duration(self, id, duration):
-        cursor = self.db.cursor()
+    def get_idens_in_other_feeds(self, feed_id, idens, cursor=None):
+        ans = set()
+        if cursor is None:
+            cursor = self.db.cursor()
+        for start in range(0, len(idens), 500):
+            chunk = idens[start:start + 500]
+            cursor.execute('''SELECT IDEN FROM TRACKS WHERE FEED_ID!=? AND
+ IDEN IN ({0})'''.format(', '.join('?' * len(chunk))), [feed_id] + chunk)
+            for row in cursor.fetchall():
+                ans.add(row[0])
+        return ans
+
+    def set_feed_checked(self, feed_id, checked=None):
+        if checked is None:
+            checked = int(time.time())
         try:
-            cursor.execute('''UPDATE TRACKS SET DURATION=? WHERE ID=?''',
-                           (duration, id))
-            self.db.commit()
+            self.execute('''UPDATE FEEDS SET LAST_CHECKED=? WHERE ID=?''',
+                         (checked, feed_id))
         except Exception as e:
             print('---', e, '---')
-        cursor.close()
 
-    def set_track_position(self, id, position):
+    def get_track_dates(self, limit):
+        '''
+        Return the dates of the last limit tracks of every feed, newest
+        first, as a dict feed_id -> list of dates.
+        '''
+        ans = {}
         cursor = self.db.cursor()
         try:
-            cursor.execute('''UPDATE TRACKS SET POSITION=? WHERE ID=?''',
-                           (position, id))
-            self.db.commit()
-        except Exception as e:
+            cursor.execute('''SELECT FEED_ID, DATE FROM (
+ SELECT FEED_ID, DATE, ROW_NUMBER() OVER (
+ PARTITION BY FEED_ID ORDER BY DATE DESC) AS N FROM TRACKS)
+ WHERE N<=? ORDER BY FEED_ID, DATE DESC''', (limit,))
+            for feed_id, date in cursor.fetchall():
+                ans.setdefault(feed_id, []).append(date)
+        except sqlite3.OperationalError as e:
             print('---', e, '---')
         cursor.close()
+        return ans
+
+    def set_feed_validators(self, feed_id, validators):
+        if validators is None:
+            return
+        try:
+            self.execute('''UPDATE FEEDS SET ETAG=?, LAST_MODIFIED=?,
+ BODY_HASH=? WHERE ID=?''', (validators['etag'], validators['last_modified'],
+                             validators['body_hash'], feed_id))
+        except Exception as e:
+            print('---', e, '---')
+
+    def set_track_duration(self, id, duration):
+        self.buffer_track_update(id, 'DURATION', duration)
+
+    def set_track_position(self, id, position):
+        self.buffer_track_update(id, 'POSITION', position)
 
     def set_track_position_in_list(self, id, list_id, position):
-        cursor = self.db.cursor()
         try:
-            cursor.execute(
+            self.execute(
                 '''UPDATE LIST SET POSITION=? WHERE LIST_ID=? AND ID=?''',
                 (position, list_id, id))
-            self.db.commit()
         except Exception as e:
             print('---', e, '---')
-        cursor.close()
 
     def set_track_listened(self, id):
-        cursor = self.db.cursor()
-        try:
-            cursor.execute('''UPDATE TRACKS SET LISTENED=1 WHERE ID=?''',
-                           (id,))
-            self.db.commit()
-        except Exception as e:
-            print('---', e, '---')
-        cursor.close()
+        self.buffer_track_update(id, 'LISTENED', 1)
 
     def set_track_no_listened(self, id):
-        cursor = self.db.cursor()
-        try:
-            cursor.execute('''UPDATE TRACKS SET LISTENED=0 WHERE ID=?''',
-                           (id,))
-            self.db.commit()
-        except Exception as e:
-            print('---', e, '---')
-        cursor.close()
+        self.buffer_track_update(id, 'LISTENED', 0)
 
     def is_track_listened(self, id):
+        pending = self.get_pending().get(id, {})
+        if 'LISTENED' in pending:
+            return pending['LISTENED'] == 1
         cursor = self.db.cursor()
         try:
             cursor.execute('''SELECT LISTENED FROM TRACKS WHERE ID=?''',
@@ -356,24 +732,18 @@ class DBManager():
         return False
 
     def set_track_downloaded(self, id, filename):
-        cursor = self.db.cursor()
         try:
-            cursor.execute('''UPDATE TRACKS SET FILENAME=?, DOWNLOADED=1 WHERE
+            self.execute('''UPDATE TRACKS SET FILENAME=?, DOWNLOADED=1 WHERE
  ID=?''', (filename, id))
-            self.db.commit()
         except Exception as e:
             print('---', e, '---')
-        cursor.close()
 
     def set_track_no_downloaded(self, id):
-        cursor = self.db.cursor()
         try:
-            cursor.execute('''UPDATE TRACKS SET DOWNLOADED=0 WHERE ID=?''',
-                           (id,))
-            self.db.commit()
+            self.execute('''UPDATE TRACKS SET DOWNLOADED=0 WHERE ID=?''',
+                         (id,))
         except Exception as e:
             print('---', e, '---')
-        cursor.close()
 
     def is_track_downloaded(self, id):
         cursor = self.db.cursor()
@@ -392,75 +762,61 @@ class DBManager():
 
     def get_max_norder(self, table):
         cursor = self.db.cursor()
-        cursor.execute('''SELECT max(NORDER) FROM {0}'''.format(table))
-        ans = cursor.fetchone()[0]
+        ans = select_max_norder(cursor, table)
         cursor.close()
-        if ans is None:
-            return 0
         return ans
 
     def get_max_norder_in_list(self, list_id):
         cursor = self.db.cursor()
-        cursor.execute('''SELECT max(NORDER) FROM LIST WHERE LIST_ID=?''',
-                       (list_id,))
-        ans = cursor.fetchone()[0]
+        ans = select_max_norder_in_list(cursor, list_id)
         cursor.close()
-        if ans is None:
-            return 0
         return ans
 
     def add_list(self, listname):
-        norder = self.get_max_norder('LISTS')
-        cursor = self.db.cursor()
-        try:
-            norder += 1
+        def insert_list(cursor):
+            norder = select_max_norder(cursor, 'LISTS') + 1
             cursor.execute('''INSERT INTO LISTS(NAME, NORDER) VALUES(?, ?)''',
                            (listname, norder))
-            self.db.commit()
-            cursor.close()
             return cursor.lastrowid
+
+        try:
+            return self.write(insert_list)
         except Exception as e:
             print('---', e, '---')
-        cursor.close()
         return None
 
     def sort_list(self, elements):
-        cursor = self.db.cursor()
-        for element in elements:
-            id, norder = element
-            try:
-                cursor.execute('''UPDATE LIST SET NORDER=? WHERE ID=?''',
-                               (norder, id))
-            except Exception as e:
-                print('---', e, '---')
-        self.db.commit()
-        cursor.close()
+        def update_norders(cursor):
+            for element in elements:
+                id, norder = element
+                try:
+                    cursor.execute('''UPDATE LIST SET NORDER=? WHERE ID=?''',
+                                   (norder, id))
+                except Exception as e:
+                    print('---', e, '---')
+
+        self.write(update_norders)
 
     def add_track_to_list(self, list_id, track_id):
-        norder = self.get_max_norder_in_list(list_id)
-        cursor = self.db.cursor()
-        try:
-            norder += 1
+        def insert_track(cursor):
+            norder = select_max_norder_in_list(cursor, list_id) + 1
             cursor.execute('''INSERT INTO LIST(LIST_ID, TRACK_ID, POSITION,
 NORDER) VALUES(?, ?, ?, ?)''', (list_id, track_id, False, norder))
-            self.db.commit()
-            cursor.close()
             return cursor.lastrowid
+
+        try:
+            return self.write(insert_track)
         except Exception as e:
             print('---', e, '---')
-        cursor.close()
         return None
 
     def removed_viewed_from_list(self, list_id):
-        cursor = self.db.cursor()
         try:
-            cursor.execute(
+            self.execute(
                 '''DELETE FROM LIST WHERE LIST_ID=? AND POSITION=?''',
                 (list_id, 100))
-            self.db.commit()
         except Exception as e:
             print('---', e, '---')
-        cursor.close()
 
     def get_feed_id(self, url):
         cursor = self.db.cursor()
@@ -478,12 +834,10 @@ NORDER) VALUES(?, ?, ?, ?)''', (list_id, track_id, False, norder))
     def get_feeds(self):
         ans = []
         cursor = self.db.cursor()
+        cursor.row_factory = FeedRecord.row_factory()
         try:
             cursor.execute('SELECT * FROM FEEDS')
-            data = cursor.fetchall()
-            cursor.close()
-            for element in data:
-                ans.append(Feed(element))
+            ans = cursor.fetchall()
         except (sqlite3.IntegrityError, AttributeError) as e:
             print('---', e, '---')
         cursor.close()
@@ -492,19 +846,56 @@ NORDER) VALUES(?, ?, ?, ?)''', (list_id, track_id, False, norder))
     def get_tracks_from_list(self, list_id):
         ans = []
         cursor = self.db.cursor()
+        cursor.row_factory = TrackSummaryRecord.row_factory(
+            self.get_track_detail)
         try:
-            cursor.execute('SELECT * FROM TRACKS_LIST_VIEW WHERE LIST_ID=?',
-                           (list_id,))
-            data = cursor.fetchall()
-            cursor.close()
-            for element in data:
-                track = Track()
-                track.set_from_tracks_list_view(element)
-                ans.append(track)
+            cursor.execute('''SELECT {0}, LIST_ID FROM TRACKS_LIST_VIEW
+ WHERE LIST_ID=?'''.format(TRACK_SUMMARY_COLUMNS), (list_id,))
+            ans = cursor.fetchall()
         except (sqlite3.IntegrityError, AttributeError) as e:
             print('---', e, '---')
         cursor.close()
-        return ans
+        return self.merge_pending(ans, PENDING_LIST_COLUMNS)
+
+    def get_tracks_page_from_list(self, list_id, after=None,
+                                  limit=TRACKS_PAGE_SIZE):
+        '''
+        Return up to limit tracks of the list in (NORDER, ID) order,
+        starting after the (norder, id) key of the last track of the
+        previous page, or from the beginning when after is None.
+        '''
+        ans = []
+        cursor = self.db.cursor()
+        cursor.row_factory = TrackSummaryRecord.row_factory(
+            self.get_track_detail)
+        try:
+            if after is None:
+                cursor.execute('''SELECT {0}, LIST_ID FROM TRACKS_LIST_VIEW
+ WHERE LIST_ID=? ORDER BY NORDER, ID LIMIT ?'''.format(TRACK_SUMMARY_COLUMNS),
+                               (list_id, limit))
+            else:
+                cursor.execute('''SELECT {0}, LIST_ID FROM TRACKS_LIST_VIEW
+ WHERE LIST_ID=? AND (NORDER, ID) > (?, ?) ORDER BY NORDER, ID
+ LIMIT ?'''.format(TRACK_SUMMARY_COLUMNS), (list_id, *after, limit))
+            ans = cursor.fetchall()
+        except (sqlite3.IntegrityError, AttributeError) as e:
+            print('---', e, '---')
+        cursor.close()
+        return self.merge_pending(ans, PENDING_LIST_COLUMNS)
+
+    def iter_tracks_from_list(self, list_id, limit=TRACKS_PAGE_SIZE):
+        '''
+        Yield the tracks of the list in pages of at most limit tracks. Each
+        page is a new query, so nothing is held open between pages.
+        '''
+        after = None
+        while True:
+            page = self.get_tracks_page_from_list(list_id, after, limit)
+            if len(page) > 0:
+                yield page
+            if len(page) < limit:
+                break
+            after = (page[-1]['norder'], page[-1]['id'])
 
     def get_track_from_list(self, id):
         cursor = self.db.cursor()
@@ -512,9 +903,8 @@ NORDER) VALUES(?, ?, ?, ?)''', (list_id, track_id, False, norder))
             cursor.execute('SELECT * FROM TRACKS_LIST_VIEW WHERE ID=?', (id,))
             ans = cursor.fetchone()
             cursor.close()
-            track = Track()
-            track.set_from_tracks_list_view(ans)
-            return track
+            return self.merge_pending([TrackRecord(ans)],
+                                      PENDING_LIST_COLUMNS)[0]
         except (sqlite3.IntegrityError, AttributeError) as e:
             print('---', e, '---')
         cursor.close()
@@ -523,23 +913,62 @@ NORDER) VALUES(?, ?, ?, ?)''', (list_id, track_id, False, norder))
     def get_tracks_from_feed(self, feed_id, olderthan=None):
         ans = []
         cursor = self.db.cursor()
+        cursor.row_factory = TrackSummaryRecord.row_factory(
+            self.get_track_detail)
         try:
             if olderthan is None:
-                cursor.execute('''SELECT * FROM TRACKS_FEED_VIEW WHERE
- FEED_ID=? ORDER BY DATE DESC''', (feed_id,))
+                cursor.execute('''SELECT {0} FROM TRACKS_FEED_VIEW WHERE
+ FEED_ID=? ORDER BY DATE DESC'''.format(TRACK_SUMMARY_COLUMNS), (feed_id,))
             else:
-                cursor.execute('''SELECT * FROM TRACKS_FEED_VIEW WHERE
- FEED_ID=? AND DATE>? ORDER BY DATE DESC''', (feed_id, olderthan,))
-            data = cursor.fetchall()
-            cursor.close()
-            for element in data:
-                track = Track()
-                track.set_from_tracks_feed_view(element)
-                ans.append(track)
+                cursor.execute('''SELECT {0} FROM TRACKS_FEED_VIEW WHERE
+ FEED_ID=? AND DATE>? ORDER BY DATE DESC'''.format(TRACK_SUMMARY_COLUMNS),
+                               (feed_id, olderthan,))
+            ans = cursor.fetchall()
         except (sqlite3.IntegrityError, AttributeError) as e:
             print('---', e, '---')
         cursor.close()
-        return ans
+        return self.merge_pending(ans)
+
+    def get_tracks_page_from_feed(self, feed_id, after=None,
+                                  limit=TRACKS_PAGE_SIZE):
+        '''
+        Return up to limit tracks of the feed, newest first in (DATE, ID)
+        order, starting after the (date, id) key of the last track of the
+        previous page, or from the newest one when after is None.
+        '''
+        ans = []
+        cursor = self.db.cursor()
+        cursor.row_factory = TrackSummaryRecord.row_factory(
+            self.get_track_detail)
+        try:
+            if after is None:
+                cursor.execute('''SELECT {0} FROM TRACKS_FEED_VIEW
+ WHERE FEED_ID=? ORDER BY DATE DESC, ID DESC
+ LIMIT ?'''.format(TRACK_SUMMARY_COLUMNS), (feed_id, limit))
+            else:
+                cursor.execute('''SELECT {0} FROM TRACKS_FEED_VIEW
+ WHERE FEED_ID=? AND (DATE, ID) < (?, ?) ORDER BY DATE DESC, ID DESC
+ LIMIT ?'''.format(TRACK_SUMMARY_COLUMNS), (feed_id, *after, limit))
+            ans = cursor.fetchall()
+        except (sqlite3.IntegrityError, AttributeError) as e:
+            print('---', e, '---')
+        cursor.close()
+        return self.merge_pending(ans)
+
+    def iter_tracks_from_feed(self, feed_id, limit=TRACKS_PAGE_SIZE):
+        '''
+        Yield the tracks of the feed, newest first, in pages of at most
+        limit tracks. Each page is a new query, so nothing is held open
+        between pages.
+        '''
+        after = None
+        while True:
+            page = self.get_tracks_page_from_feed(feed_id, after, limit)
+            if len(page) > 0:
+                yield page
+            if len(page) < limit:
+                break
+            after = (page[-1]['date'], page[-1]['id'])
 
     def get_track_from_feed(self, id):
         cursor = self.db.cursor()
@@ -547,26 +976,118 @@ NORDER) VALUES(?, ?, ?, ?)''', (list_id, track_id, False, norder))
             cursor.execute('SELECT * FROM TRACKS_FEED_VIEW WHERE ID=?', (id,))
             ans = cursor.fetchone()
             cursor.close()
-            track = Track()
-            track.set_from_tracks_feed_view(ans)
-            return track
+            return self.merge_pending([TrackRecord(ans)])[0]
         except (sqlite3.IntegrityError, AttributeError) as e:
             print('---', e, '---')
         cursor.close()
         return None
 
+    def get_track_detail(self, id):
+        '''
+        Return the columns left out of a track summary (iden, link and
+        description) of a track as a dict, empty if there is no track.
+        '''
+        ans = {}
+        cursor = self.db.cursor()
+        try:
+            cursor.execute('''SELECT IDEN, LINK, DESCRIPTION FROM TRACKS
+ WHERE ID=?''', (id,))
+            data = cursor.fetchone()
+            if data is not None:
+                ans = dict(zip(TrackSummaryRecord.DETAIL, data))
+        except (sqlite3.IntegrityError, AttributeError) as e:
+            print('---', e, '---')
+        cursor.close()
+        return ans
+
+    def search_tracks(self, query, limit=50, offset=0,
+                      newest=SEARCH_CANDIDATES):
+        '''
+        Return the summaries of the tracks matching query, best first, with
+        a snippet of the matching text in the 'snippet' key. Title matches
+        rank higher than feed title matches, and these higher than
+        description matches.
+
+        Only the newest matches are ranked, newest of them (or offset +
+        limit if more), so older tracks are left out when the query is
+        common. Set newest to None to rank every match, which is much slower
+        for words found in most of the library.
+        '''
+        ans = []
+        fts_query = get_fts_query(query)
+        if fts_query is None:
+            return ans
+        if newest is None:
+            candidates = -1
+        else:
+            candidates = max(newest, offset + limit)
+        cursor = self.db.cursor()
+        try:
+            cursor.execute('''SELECT TRACK_ID FROM (
+ SELECT rowid AS TRACK_ID, rank AS TRACK_RANK FROM TRACKS_FTS
+ WHERE TRACKS_FTS MATCH ? ORDER BY rowid DESC LIMIT ?)
+ ORDER BY TRACK_RANK LIMIT ? OFFSET ?''', (fts_query, candidates, limit,
+                                            offset))
+            ids = [row[0] for row in cursor.fetchall()]
+            if len(ids) > 0:
+                marks = ', '.join('?' * len(ids))
+                # The rowid range keeps the snippets to the matches of the
+                # page, +rowid stops FTS5 from seeking each id on its own
+                cursor.execute('''SELECT rowid,
+ snippet(TRACKS_FTS, -1, ?, ?, '...', ?) FROM TRACKS_FTS
+ WHERE TRACKS_FTS MATCH ? AND rowid BETWEEN ? AND ?
+ AND +rowid IN ({0})'''.format(marks),
+                               [SNIPPET_START, SNIPPET_END, SNIPPET_TOKENS,
+                                fts_query, min(ids), max(ids)] + ids)
+                snippets = dict(cursor.fetchall())
+                cursor.row_factory = TrackSummaryRecord.row_factory(
+                    self.get_track_detail)
+                cursor.execute('''SELECT {0} FROM TRACKS_FEED_VIEW
+ WHERE ID IN ({1})'''.format(TRACK_SUMMARY_COLUMNS, marks), ids)
+                tracks = {}
+                for track in cursor.fetchall():
+                    track.snippet = snippets.get(track['id'])
+                    tracks[track['id']] = track
+                ans = [tracks[id] for id in ids if id in tracks]
+        except sqlite3.OperationalError as e:
+            print('---', e, '---')
+        cursor.close()
+        return self.merge_pending(ans)
+
     def get_unlistened_tracks_in_feed(self, id):
         print(id, type(id))
         ans = 0
         cursor = self.db.cursor()
         try:
-            cursor.execute('''SELECT COUNT(LISTENED) FROM TRACKS WHERE
-                           LISTENED=0 AND FEED_ID=?;''', (id,))
+            cursor.execute('''SELECT UNLISTENED FROM FEED_COUNTERS WHERE
+                           FEED_ID=?;''', (id,))
             ans = cursor.fetchone()[0]
             cursor.close()
-        except (sqlite3.IntegrityError, AttributeError) as e:
+        except (sqlite3.IntegrityError, AttributeError, TypeError) as e:
             print('---', e, '---')
         cursor.close()
+        return ans + self.get_pending_unlistened().get(id, 0)
+
+    def get_feed_counters(self):
+        '''
+        Return the counters of every feed in one query, as a dict
+        feed_id -> {'total', 'unlistened', 'downloaded'}.
+        '''
+        ans = {}
+        cursor = self.db.cursor()
+        try:
+            cursor.execute('''SELECT FEED_ID, TOTAL, UNLISTENED, DOWNLOADED
+ FROM FEED_COUNTERS''')
+            for feed_id, total, unlistened, downloaded in cursor.fetchall():
+                ans[feed_id] = {'total': total,
+                                'unlistened': unlistened,
+                                'downloaded': downloaded}
+        except sqlite3.OperationalError as e:
+            print('---', e, '---')
+        cursor.close()
+        for feed_id, difference in self.get_pending_unlistened().items():
+            if feed_id in ans:
+                ans[feed_id]['unlistened'] += difference
         return ans
 
     def get_last_track_from_feed(self, id):
@@ -576,7 +1097,7 @@ NORDER) VALUES(?, ?, ?, ?)''', (list_id, track_id, False, norder))
  WHERE FEED_ID=? ORDER BY DATE DESC LIMIT 1;''', (id,))
             ans = cursor.fetchone()
             cursor.close()
-            ans = Track(ans)
+            ans = TrackRecord(ans)
         except (sqlite3.IntegrityError, AttributeError) as e:
             print('---', e, '---')
         cursor.close()
@@ -585,17 +1106,14 @@ NORDER) VALUES(?, ?, ?, ?)''', (list_id, track_id, False, norder))
     def get_tracks(self):
         ans = []
         cursor = self.db.cursor()
+        cursor.row_factory = TrackRecord.row_factory()
         try:
             cursor.execute('SELECT * FROM TRACKS')
-            data = cursor.fetchall()
-            cursor.close()
-            cursor.close()
-            for element in data:
-                ans.append(Track(element))
+            ans = cursor.fetchall()
         except (sqlite3.IntegrityError, AttributeError) as e:
             print('---', e, '---')
         cursor.close()
-        return ans
+        return self.merge_pending(ans)
 
     def get_track(self, id):
         ans = None
@@ -604,10 +1122,12 @@ NORDER) VALUES(?, ?, ?, ?)''', (list_id, track_id, False, norder))
             cursor.execute('SELECT * FROM TRACKS WHERE ID=?', (id,))
             ans = cursor.fetchone()
             cursor.close()
-            ans = Track(ans)
+            ans = TrackRecord(ans)
         except (sqlite3.IntegrityError, AttributeError) as e:
             print('---', e, '---')
         cursor.close()
+        if ans is not None:
+            self.merge_pending([ans])
         return ans
 
     def get_feed(self, id):
@@ -617,7 +1137,7 @@ NORDER) VALUES(?, ?, ?, ?)''', (list_id, track_id, False, norder))
             cursor.execute('SELECT * FROM FEEDS WHERE ID=?', (id,))
             ans = cursor.fetchone()
             cursor.close()
-            ans = Feed(ans)
+            ans = FeedRecord(ans)
         except (sqlite3.IntegrityError, AttributeError) as e:
             print('---', e, '---')
         cursor.close()
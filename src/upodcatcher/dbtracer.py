@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# dbtracer.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import json
+import time
+import inspect
+import threading
+from collections import deque
+from . import comun
+
+# Set to 1 to trace into TRACE_FILE or to the file the report is wanted in
+TRACE_ENV = 'UPODCATCHER_DB_TRACE'
+# Milliseconds a statement must take to be kept as a slow query
+SLOW_QUERY_ENV = 'UPODCATCHER_DB_SLOW_MS'
+TRACE_FILE = os.path.join(comun.CONFIG_APP_DIR, 'dbtrace.json')
+SLOW_QUERY_MS = 50
+MAX_SLOW_QUERIES = 100
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def get_tracer():
+    '''
+    Return a DBTracer if TRACE_ENV is set in the environment, else None.
+    '''
+    value = os.environ.get(TRACE_ENV, '')
+    if value in ('', '0'):
+        return None
+    filename = TRACE_FILE if value == '1' else value
+    try:
+        slow_query_ms = float(os.environ.get(SLOW_QUERY_ENV, SLOW_QUERY_MS))
+    except ValueError:
+        slow_query_ms = SLOW_QUERY_MS
+    return DBTracer(filename, slow_query_ms)
+
+
+def normalize_statement(sql):
+    '''
+    The statement with its literals replaced by ?, so the executions of a
+    statement with different parameters add up together.
+    '''
+    return ' '.join(LITERALS.sub('?', sql).split())
+
+
+def count_rows(result):
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple, dict)):
+        return len(result)
+    return 1
+
+
+class DBTracer():
+    '''
+    Call counts, latencies and rows returned per DBManager method, and
+    counts and latencies per statement. Statements are captured with the
+    sqlite3 trace callback, that only tells when a statement starts, so a
+    statement is timed until the next one starts in the same thread or
+    until end_statement is called, at the end of every traced method and
+    of every batch of the writer. The statements run by triggers are
+    reported with the text of the statement firing them, so they are taken
+    as part of it.
+    '''
+    def __init__(self, filename=TRACE_FILE, slow_query_ms=SLOW_QUERY_MS):
+        self.filename = filename
+        self.slow_query_ms = slow_query_ms
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.methods = {}
+        self.statements = {}
+        self.slow_queries = deque(maxlen=MAX_SLOW_QUERIES)
+
+    def on_statement(self, sql):
+        '''
+        The trace callback of the traced connections.
+        '''
+        statement = getattr(self.local, 'statement', None)
+        if sql.startswith('--') or\
+                (statement is not None and statement[0] == sql):
+            return
+        self.end_statement()
+        self.local.statement = (sql, time.perf_counter())
+
+    def end_statement(self):
+        statement = getattr(self.local, 'statement', None)
+        if statement is not None:
+            self.local.statement = None
+            sql, start = statement
+            self.add_statement(sql, (time.perf_counter() - start) * 1000)
+
+    def add_statement(self, sql, elapsed):
+        key = normalize_statement(sql)
+        with self.lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+                self.statements[key] = stats
+            stats['calls'] += 1
+            stats['total_ms'] += elapsed
+            stats['max_ms'] = max(stats['max_ms'], elapsed)
+            if elapsed >= self.slow_query_ms:
+                self.slow_queries.append({
+                    'sql': sql,
+                    'ms': round(elapsed, 3),
+                    'thread': threading.current_thread().name,
+                    'time': time.time()})
+
+    def add_call(self, name, elapsed, rows):
+        with self.lock:
+            stats = self.methods.get(name)
+            if stats is None:
+                stats = {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                         'rows': 0}
+                self.methods[name] = stats
+            stats['calls'] += 1
+            stats['total_ms'] += elapsed
+            stats['max_ms'] = max(stats['max_ms'], elapsed)
+            stats['rows'] += rows
+
+    def wrap(self, name, function):
+        def traced(*args, **kwargs):
+            start = time.perf_counter()
+            rows = 0
+            try:
+                ans = function(*args, **kwargs)
+                rows = count_rows(ans)
+                return ans
+            finally:
+                self.end_statement()
+                self.add_call(name, (time.perf_counter() - start) * 1000,
+                              rows)
+        traced.__name__ = name
+        traced.__doc__ = function.__doc__
+        return traced
+
+    def instrument(self, instance, exclude=()):
+        '''
+        Replace the public methods of instance by traced ones. Generators
+        are left alone, the methods they call are traced instead.
+        '''
+        for name, value in inspect.getmembers(type(instance)):
+            if name.startswith('_') or name in exclude or\
+                    not inspect.isfunction(value) or\
+                    inspect.isgeneratorfunction(value):
+                continue
+            setattr(instance, name, self.wrap(name, getattr(instance, name)))
+
+    def get_report(self):
+        def get_rows(stats, key):
+            ans = []
+            for name, values in stats.items():
+                values = dict(values)
+                values[key] = name
+                values['mean_ms'] = values['total_ms'] / values['calls']
+                for field in ('total_ms', 'max_ms', 'mean_ms'):
+                    values[field] = round(values[field], 3)
+                ans.append(values)
+            ans.sort(key=lambda values: values['total_ms'], reverse=True)
+            return ans
+
+        with self.lock:
+            return {'slow_query_ms': self.slow_query_ms,
+                    'methods': get_rows(self.methods, 'method'),
+                    'statements': get_rows(self.statements, 'sql'),
+                    'slow_queries': list(self.slow_queries)}
+
+    def dump(self, filename=None):
+        '''
+        Write the report as json to filename, or to the tracer filename,
+        and return the filename.
+        '''
+        if filename is None:
+            filename = self.filename
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(self.get_report(), f, indent=2)
+        os.replace(filename + '.tmp', filename)
+        return filename
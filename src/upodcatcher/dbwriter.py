@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# dbwriter.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+MAX_BATCH = 100
+BUSY_TIMEOUT = 5000
+
+
+def connect(database, readonly=False, tracer=None):
+    '''
+    Open a connection in WAL mode. Read connections are query_only and
+    belong to the thread that opens them, the write connection is in
+    autocommit mode because the writer handles the transactions itself.
+    The statements are reported to tracer, a DBTracer, if there is one.
+    '''
+    if readonly:
+        db = sqlite3.connect(database)
+        db.execute('PRAGMA query_only=ON')
+    else:
+        db = sqlite3.connect(database, isolation_level=None,
+                             check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('PRAGMA foreign_keys=ON')
+    db.execute('PRAGMA busy_timeout={0}'.format(BUSY_TIMEOUT))
+    if tracer is not None:
+        db.set_trace_callback(tracer.on_statement)
+    return db
+
+
+class DBWriter(threading.Thread):
+    '''
+    Thread that owns the only connection allowed to write to the database.
+    Mutations are queued as functions that take a cursor. The writer drains
+    the queue and runs up to max_batch of them in a single transaction,
+    each one in its own savepoint so a failing mutation doesn't take the
+    others with it. The futures are resolved once the batch is committed,
+    so the caller can read its own writes from any read connection.
+    '''
+    def __init__(self, database, max_batch=MAX_BATCH, tracer=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.max_batch = max_batch
+        self.tracer = tracer
+        self.queue = queue.Queue()
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.db = connect(database, tracer=tracer)
+
+    def submit(self, function, *args, exclusive=False):
+        '''
+        Queue function(cursor, *args) and return a Future with its result.
+        Exclusive functions run alone and outside any transaction, for
+        scripts and migrations that handle the transaction themselves.
+        Raises sqlite3.ProgrammingError once the writer has been stopped,
+        as nobody would run the function.
+        '''
+        future = Future()
+        if threading.current_thread() is self:
+            # Nested write from a queued function, it joins the batch
+            cursor = self.db.cursor()
+            try:
+                future.set_result(function(cursor, *args))
+            except Exception as e:
+                future.set_exception(e)
+            cursor.close()
+        else:
+            with self.lock:
+                if self.stopped:
+                    raise sqlite3.ProgrammingError(
+                        'the database writer is stopped')
+                self.queue.put((function, args, future, exclusive))
+        return future
+
+    def run(self):
+        running = True
+        while running:
+            jobs = [self.queue.get()]
+            while len(jobs) < self.max_batch:
+                try:
+                    jobs.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = []
+            for job in jobs:
+                if job is None:
+                    running = False
+                    break
+                if job[3]:
+                    self.run_batch(batch)
+                    batch = []
+                    self.run_exclusive(job)
+                else:
+                    batch.append(job)
+            self.run_batch(batch)
+            if self.tracer is not None:
+                self.tracer.end_statement()
+        self.db.close()
+
+    def run_exclusive(self, job):
+        function, args, future, exclusive = job
+        cursor = self.db.cursor()
+        try:
+            future.set_result(function(cursor, *args))
+        except Exception as e:
+            if self.db.in_transaction:
+                self.db.rollback()
+            future.set_exception(e)
+        cursor.close()
+
+    def run_batch(self, jobs):
+        if len(jobs) == 0:
+            return
+        results = []
+        cursor = self.db.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for function, args, future, exclusive in jobs:
+                cursor.execute('SAVEPOINT job')
+                try:
+                    results.append((future, function(cursor, *args), None))
+                except Exception as e:
+                    results.append((future, None, e))
+                    cursor.execute('ROLLBACK TO job')
+                cursor.execute('RELEASE job')
+            cursor.execute('COMMIT')
+        except sqlite3.Error as e:
+            print('---', e, '---')
+            if self.db.in_transaction:
+                self.db.rollback()
+            results = [(job[2], None, e) for job in jobs]
+        cursor.close()
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stop(self):
+        '''
+        Write everything already queued and close the connection.
+        '''
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.queue.put(None)
+        if self.is_alive():
+            self.join()
@@ -30,10 +30,7 @@ except Exception as e:
 from gi.repository import GLib
 from gi.repository import GObject
 import threading
-import requests
-import os
-from urllib.parse import urlparse
-from . import comun
+from .trackdownloader import download_track
 
 
 class Downloader(threading.Thread, GObject.GObject):
@@ -41,13 +38,19 @@ class Downloader(threading.Thread, GObject.GObject):
         'started': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, ()),
         'ended': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, ()),
         'failed': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, ()),
+        # received bytes, total bytes or None, bytes per second, eta or None
+        'progress': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE,
+                     (object, object, object, object)),
     }
 
-    def __init__(self, row):
+    def __init__(self, row, background=False):
         threading.Thread.__init__(self)
         GObject.GObject.__init__(self)
         self.row = row
+        self.background = background
         self.daemon = True
+        self.progress = None
+        self.progress_lock = threading.Lock()
 
     def get_row(self):
         return self.row
@@ -55,19 +58,26 @@ class Downloader(threading.Thread, GObject.GObject):
     def emit(self, *args):
         GLib.idle_add(GObject.GObject.emit, self, *args)
 
+    def on_progress(self, *progress):
+        # Only the last report waits for the main loop, a report coming
+        # while it waits replaces it instead of queueing another call
+        with self.progress_lock:
+            pending = self.progress is not None
+            self.progress = progress
+        if not pending:
+            GLib.idle_add(self.emit_progress)
+
+    def emit_progress(self):
+        with self.progress_lock:
+            progress = self.progress
+            self.progress = None
+        GObject.GObject.emit(self, 'progress', *progress)
+        return False
+
     def run(self):
         try:
             self.emit('started')
-            path = urlparse(self.row.data['url']).path
-            extension = os.path.splitext(path)[1]
-            filename = os.path.join(
-                comun.PODCASTS_DIR,
-                'podcast_{0}{1}'.format(self.row.data['id'], extension))
-            r = requests.get(self.row.data['url'], stream=True)
-            with open(filename, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
+            download_track(self.row.data, self.background, self.on_progress)
             self.emit('ended')
         except Exception as e:
             print(e)
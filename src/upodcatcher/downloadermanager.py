@@ -29,58 +29,197 @@ except Exception as e:
     exit(1)
 from gi.repository import GObject
 from gi.repository import GLib
+import time
+import heapq
+import itertools
+from urllib.parse import urlparse
 from .downloader import Downloader
 
 MAX_DOWNLOADERS = 4
+MAX_DOWNLOADERS_PER_HOST = 2
+MAX_TRIES = 4
+# Seconds before the first retry of a failed download, doubled on each
+# retry up to MAX_BACKOFF
+BACKOFF = 5
+MAX_BACKOFF = 5 * 60
+# Lower goes first
+PRIORITY_USER = 0
+PRIORITY_AUTO = 10
+# Seconds between two throughput reports
+THROUGHPUT_INTERVAL = 1
+
+
+class DownloadItem():
+    '''
+    A download the manager knows about, queued, running or waiting to be
+    retried, with its own count of failed tries.
+    '''
+    def __init__(self, row, priority):
+        self.row = row
+        self.priority = priority
+        self.host = urlparse(row.data['url']).netloc
+        self.tries = 0
+        self.entry = None
+        self.retry_source = None
+        self.rate = 0.0
 
 
 class DownloaderManager(GObject.GObject):
+    '''
+    Runs up to max_downloaders downloads at once, and no more than
+    max_per_host (or the limit in host_limits for that host) against the
+    same host. Queued downloads start by priority, user requests before
+    automatic ones, and in the order they came within a priority. A failed
+    download is retried after a backoff that doubles with each of its own
+    failures, and reported as failed after MAX_TRIES. The progress of every
+    download is passed on, and the sum of their rates is reported as
+    throughput at most every THROUGHPUT_INTERVAL seconds.
+    '''
     __gsignals__ = {
         'started': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, (object,)),
         'ended': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, (object,)),
         'failed': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, (object,)),
+        # row, received bytes, total bytes, bytes per second, eta
+        'progress': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE,
+                     (object, object, object, object, object)),
+        # bytes per second of all the downloads, number of downloads
+        'throughput': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE,
+                       (float, int)),
     }
 
-    def __init__(self):
+    def __init__(self, max_downloaders=MAX_DOWNLOADERS,
+                 max_per_host=MAX_DOWNLOADERS_PER_HOST, host_limits=None):
         GObject.GObject.__init__(self)
-        self.downloaders = []
+        self.max_downloaders = max_downloaders
+        self.max_per_host = max_per_host
+        self.host_limits = dict(host_limits or {})
         self.queue = []
-        self.tries = 0
+        self.counter = itertools.count()
+        self.items = {}
+        self.downloaders = {}
+        self.hosts = {}
+        self.throughput_reported = 0
 
     def emit(self, *args):
         GLib.idle_add(GObject.GObject.emit, self, *args)
 
-    def on_downloader_ended(self, widget, downloader):
-        self.emit('ended', downloader.get_row())
-        self.downloaders.remove(downloader)
-        if len(self.queue) > 0:
-            new_row = self.queue.pop()
-            self.download(new_row)
+    def set_limits(self, max_downloaders=None, max_per_host=None,
+                   host_limits=None):
+        '''
+        Change the limits, host_limits replaces the per host limits. Running
+        downloads are not stopped when the limits go down.
+        '''
+        if max_downloaders is not None:
+            self.max_downloaders = max_downloaders
+        if max_per_host is not None:
+            self.max_per_host = max_per_host
+        if host_limits is not None:
+            self.host_limits = dict(host_limits)
+        self.schedule()
 
-    def on_downloader_failed(self, widget, downloader):
-        self.emit('failed', downloader.get_row())
-        if self.tries < 3:
-            self.downloaders.remove(downloader)
-            self.queue.insert(0, downloader.get_row())
-        else:
-            self.tries = 0
-        if len(self.queue) > 0:
-            new_row = self.queue.pop()
-            if new_row == downloader.get_row():
-                self.tries += 1
-            self.download(new_row)
-
-    def add(self, row):
-        print('add')
-        if len(self.downloaders) < MAX_DOWNLOADERS:
-            self.download(row)
-        else:
-            self.queue.insert(0, row)
+    def get_host_limit(self, host):
+        return self.host_limits.get(host, self.max_per_host)
+
+    def push(self, item):
+        # Queue entries are not removed when an item is queued again with
+        # another priority, the stale ones are skipped by schedule
+        item.entry = (item.priority, next(self.counter), item)
+        heapq.heappush(self.queue, item.entry)
+
+    def add(self, row, priority=PRIORITY_USER):
+        item = self.items.get(row.data['id'])
+        if item is None:
+            item = DownloadItem(row, priority)
+            self.items[row.data['id']] = item
+            self.push(item)
+        elif item.retry_source is not None and priority <= item.priority:
+            # Asked again while waiting to be retried, retry now
+            GLib.source_remove(item.retry_source)
+            item.retry_source = None
+            item.priority = priority
+            self.push(item)
+        elif item.entry is not None and priority < item.priority:
+            item.priority = priority
+            self.push(item)
+        self.schedule()
+
+    def schedule(self):
+        deferred = []
+        while len(self.queue) > 0 and\
+                len(self.downloaders) < self.max_downloaders:
+            entry = heapq.heappop(self.queue)
+            item = entry[2]
+            if item.entry is not entry:
+                continue
+            if self.hosts.get(item.host, 0) >= self.get_host_limit(item.host):
+                deferred.append(entry)
+                continue
+            item.entry = None
+            self.download(item)
+        for entry in deferred:
+            heapq.heappush(self.queue, entry)
 
-    def download(self, row):
-        downloader = Downloader(row)
+    def download(self, item):
+        downloader = Downloader(item.row, item.priority >= PRIORITY_AUTO)
         downloader.connect('ended', self.on_downloader_ended, downloader)
         downloader.connect('failed', self.on_downloader_failed, downloader)
+        downloader.connect('progress', self.on_downloader_progress,
+                           downloader)
+        self.downloaders[downloader] = item
+        self.hosts[item.host] = self.hosts.get(item.host, 0) + 1
         downloader.start()
-        self.downloaders.append(downloader)
-        self.emit('started', row)
+        self.emit('started', item.row)
+
+    def release(self, downloader):
+        item = self.downloaders.pop(downloader)
+        self.hosts[item.host] -= 1
+        if self.hosts[item.host] == 0:
+            del self.hosts[item.host]
+        item.rate = 0.0
+        self.report_throughput(force=True)
+        return item
+
+    def get_throughput(self):
+        return sum(item.rate for item in self.downloaders.values())
+
+    def report_throughput(self, force=False):
+        now = time.monotonic()
+        if force or now - self.throughput_reported >= THROUGHPUT_INTERVAL:
+            self.throughput_reported = now
+            self.emit('throughput', self.get_throughput(),
+                      len(self.downloaders))
+
+    def on_downloader_progress(self, widget, received, total, rate, eta,
+                               downloader):
+        item = self.downloaders.get(downloader)
+        if item is None:
+            return
+        item.rate = rate
+        # Already in the main loop, no need to go through idle_add
+        GObject.GObject.emit(self, 'progress', item.row, received, total,
+                             rate, eta)
+        self.report_throughput()
+
+    def on_downloader_ended(self, widget, downloader):
+        item = self.release(downloader)
+        del self.items[item.row.data['id']]
+        self.emit('ended', item.row)
+        self.schedule()
+
+    def on_downloader_failed(self, widget, downloader):
+        item = self.release(downloader)
+        item.tries += 1
+        if item.tries < MAX_TRIES:
+            backoff = min(MAX_BACKOFF, BACKOFF * 2 ** (item.tries - 1))
+            item.retry_source = GLib.timeout_add_seconds(backoff,
+                                                         self.on_retry, item)
+        else:
+            del self.items[item.row.data['id']]
+            self.emit('failed', item.row)
+        self.schedule()
+
+    def on_retry(self, item):
+        item.retry_source = None
+        self.push(item)
+        self.schedule()
+        return False
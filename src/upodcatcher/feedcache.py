@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# feedcache.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from . import comun
+
+TTL = 10 * 60
+STALE = 60 * 60
+MAX_SIZE = 50 * 1024 * 1024
+
+
+class FeedCache():
+    '''
+    Compressed copies of the raw feed bodies, one gzip file plus a json
+    file with the url, body_hash, fetch time and validators per feed. The
+    json files are touched on every hit, so their mtime drives the LRU
+    eviction that keeps the cache under max_size bytes.
+    '''
+    def __init__(self, directory=comun.FEEDS_CACHE_DIR, ttl=TTL,
+                 stale=STALE, max_size=MAX_SIZE):
+        self.directory = directory
+        self.ttl = ttl
+        self.stale = stale
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.revalidating = set()
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def get_filenames(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        filename = os.path.join(self.directory, key)
+        return filename + '.gz', filename + '.json'
+
+    def get(self, url):
+        body_filename, info_filename = self.get_filenames(url)
+        try:
+            with open(info_filename, 'r') as f:
+                info = json.load(f)
+            os.utime(info_filename)
+            return info
+        except (OSError, ValueError):
+            return None
+
+    def get_content(self, url):
+        body_filename, info_filename = self.get_filenames(url)
+        try:
+            with gzip.open(body_filename, 'rb') as f:
+                return f.read()
+        except (OSError, EOFError) as e:
+            print('---', e, '---')
+        return None
+
+    def put(self, url, content, validators):
+        body_filename, info_filename = self.get_filenames(url)
+        info = {'url': url,
+                'fetched': time.time(),
+                'etag': validators['etag'],
+                'last_modified': validators['last_modified'],
+                'body_hash': validators['body_hash']}
+        with self.lock:
+            try:
+                with gzip.open(body_filename + '.tmp', 'wb') as f:
+                    f.write(content)
+                os.replace(body_filename + '.tmp', body_filename)
+                with open(info_filename + '.tmp', 'w') as f:
+                    json.dump(info, f)
+                os.replace(info_filename + '.tmp', info_filename)
+            except OSError as e:
+                print('---', e, '---')
+            self.evict()
+
+    def touch(self, url):
+        '''
+        The server says the cached body is still valid (304).
+        '''
+        body_filename, info_filename = self.get_filenames(url)
+        with self.lock:
+            try:
+                with open(info_filename, 'r') as f:
+                    info = json.load(f)
+                info['fetched'] = time.time()
+                with open(info_filename + '.tmp', 'w') as f:
+                    json.dump(info, f)
+                os.replace(info_filename + '.tmp', info_filename)
+            except (OSError, ValueError) as e:
+                print('---', e, '---')
+
+    def is_fresh(self, info):
+        return time.time() - info['fetched'] < self.ttl
+
+    def is_usable(self, info):
+        return time.time() - info['fetched'] < self.ttl + self.stale
+
+    def revalidate(self, url, function, *args):
+        '''
+        Run function(*args) in the background unless the url is already
+        being revalidated.
+        '''
+        with self.lock:
+            if url in self.revalidating:
+                return
+            self.revalidating.add(url)
+
+        def run():
+            try:
+                function(*args)
+            except Exception as e:
+                print('---', e, '---')
+            with self.lock:
+                self.revalidating.discard(url)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                info_size = entry.stat().st_size
+                body_filename = entry.path[:-len('.json')] + '.gz'
+                try:
+                    body_size = os.path.getsize(body_filename)
+                except OSError:
+                    body_size = 0
+                total += info_size + body_size
+                entries.append((entry.stat().st_mtime, entry.path,
+                                body_filename, info_size + body_size))
+        entries.sort()
+        for mtime, info_filename, body_filename, size in entries:
+            if total <= self.max_size:
+                break
+            for filename in (info_filename, body_filename):
+                if os.path.exists(filename):
+                    os.remove(filename)
+            total -= size
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# feedrefresher.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import queue
+import threading
+from urllib.parse import urlparse
+from .dbmanager import fetch_feed
+
+MAX_WORKERS = 8
+MAX_PER_HOST = 2
+# Seconds between checks for stop while waiting for the workers
+STOP_POLL = 0.5
+
+
+def get_host(url):
+    return urlparse(url).netloc.lower()
+
+
+def interleave_by_host(feeds):
+    '''
+    Round robin the feeds over their hosts, so workers waiting for a busy
+    host don't pile up at the head of the queue.
+    '''
+    hosts = {}
+    for feed in feeds:
+        hosts.setdefault(get_host(feed['url']), []).append(feed)
+    ans = []
+    queues = list(hosts.values())
+    while len(queues) > 0:
+        for queue in queues:
+            ans.append(queue.pop(0))
+        queues = [queue for queue in queues if len(queue) > 0]
+    return ans
+
+
+class FeedRefresher():
+    '''
+    Fetch and parse feeds in a bounded pool of workers. The parsed feeds
+    are written to the database only from the thread that calls refresh,
+    so there is a single writer whatever the number of workers.
+
+    The workers are daemon threads, so a request still running when the
+    application quits doesn't keep the process alive. After stop, the
+    feeds not yet fetched are skipped and nothing more is stored.
+    '''
+    def __init__(self, db, max_workers=MAX_WORKERS,
+                 max_per_host=MAX_PER_HOST):
+        self.db = db
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.stopped = threading.Event()
+
+    def get_host_semaphore(self, url):
+        host = get_host(url)
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(
+                    self.max_per_host)
+            return self.hosts[host]
+
+    def fetch(self, feed):
+        with self.get_host_semaphore(feed['url']):
+            # A refresh always asks the server, the conditional GET keeps
+            # it cheap when nothing changed
+            return fetch_feed(feed, self.db.cache, refresh=True)
+
+    def work(self, feeds, done):
+        while not self.stopped.is_set():
+            try:
+                feed = feeds.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                done.put((feed, self.fetch(feed), None))
+            except Exception as e:
+                done.put((feed, None, e))
+
+    def store(self, feed, fetched, error):
+        new_tracks = 0
+        try:
+            if error is not None:
+                raise error
+            result = self.db.sync_feed(feed['id'], fetched)
+            new_tracks = result['inserted']
+            error = result['error']
+        except Exception as e:
+            print('---', feed['url'], e, '---')
+            error = str(e)
+        unlistened = self.db.get_unlistened_tracks_in_feed(feed['id'])
+        return feed['id'], new_tracks, unlistened, error
+
+    def refresh(self, feeds=None, on_feed_done=None):
+        '''
+        Refresh the feeds (all of them by default) and return a list of
+        (feed_id, new_tracks, unlistened, error) tuples. on_feed_done is called
+        with the same tuple as soon as each feed has been stored.
+        '''
+        if feeds is None:
+            feeds = self.db.get_feeds()
+        pending = queue.Queue()
+        for feed in interleave_by_host(feeds):
+            pending.put(feed)
+        done = queue.Queue()
+        for index in range(min(self.max_workers, len(feeds))):
+            worker = threading.Thread(target=self.work,
+                                      args=(pending, done))
+            worker.daemon = True
+            worker.start()
+        results = []
+        while len(results) < len(feeds) and not self.stopped.is_set():
+            try:
+                feed, fetched, error = done.get(timeout=STOP_POLL)
+            except queue.Empty:
+                continue
+            result = self.store(feed, fetched, error)
+            results.append(result)
+            if on_feed_done is not None:
+                on_feed_done(*result)
+        return results
+
+    def stop(self):
+        '''
+        Make refresh return as soon as the feed being stored is done.
+        '''
+        self.stopped.set()
+
+
+if __name__ == '__main__':
+    from .dbmanager import DBManager
+    refresher = FeedRefresher(DBManager(False))
+    for result in refresher.refresh(on_feed_done=print):
+        print(result)
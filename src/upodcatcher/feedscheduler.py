@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# feedscheduler.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import random
+import datetime
+import threading
+from .feedrefresher import FeedRefresher
+
+HISTORY = 10
+POLLS_PER_EPISODE = 4
+MIN_INTERVAL = 30 * 60
+MAX_INTERVAL = 24 * 60 * 60
+DEFAULT_INTERVAL = 6 * 60 * 60
+JITTER = 0.1
+BUDGET = 60
+BUDGET_PERIOD = 60 * 60
+TICK = 60
+
+
+def get_poll_interval(dates):
+    '''
+    Learn the publishing cadence from the dates of the last tracks (newest
+    first) and poll a few times per expected episode.
+    '''
+    if len(dates) < 2:
+        return DEFAULT_INTERVAL
+    timestamps = [datetime.datetime.strptime(date, '%Y%m%dT%H%M%S')
+                  for date in dates]
+    intervals = sorted((timestamps[index] - timestamps[index + 1])
+                       .total_seconds()
+                       for index in range(len(timestamps) - 1))
+    median = intervals[len(intervals) // 2]
+    return min(max(median / POLLS_PER_EPISODE, MIN_INTERVAL), MAX_INTERVAL)
+
+
+def get_next_due(feed, interval):
+    if feed['last_checked'] is None:
+        return 0
+    # The jitter is stable for a given check, so feeds added together drift
+    # apart instead of being polled in bursts.
+    jitter = random.Random(feed['id'] * 1000003 + feed['last_checked'])
+    return feed['last_checked'] + interval * (
+        1 + jitter.uniform(-JITTER, JITTER))
+
+
+class FeedScheduler(threading.Thread):
+    '''
+    Background thread that only refreshes the feeds that are due, spending
+    at most budget polls every budget_period seconds.
+    '''
+    def __init__(self, db, on_feed_done=None, refresher=None, budget=BUDGET,
+                 budget_period=BUDGET_PERIOD, tick=TICK):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.db = db
+        self.on_feed_done = on_feed_done
+        self.refresher = refresher if refresher is not None else\
+            FeedRefresher(db)
+        self.budget = budget
+        self.budget_period = budget_period
+        self.tick = tick
+        self.tokens = float(budget)
+        self.last_refill = time.time()
+        self.stopped = threading.Event()
+
+    def get_due_feeds(self, now=None):
+        if now is None:
+            now = time.time()
+        dates = self.db.get_track_dates(HISTORY)
+        due = []
+        for feed in self.db.get_feeds():
+            interval = get_poll_interval(dates.get(feed['id'], []))
+            next_due = get_next_due(feed, interval)
+            if next_due <= now:
+                due.append((next_due, feed))
+        due.sort(key=lambda element: element[0])
+        return [feed for next_due, feed in due]
+
+    def refill(self, now):
+        self.tokens = min(float(self.budget), self.tokens + (
+            now - self.last_refill) * self.budget / self.budget_period)
+        self.last_refill = now
+
+    def poll(self):
+        now = time.time()
+        self.refill(now)
+        feeds = self.get_due_feeds(now)[:int(self.tokens)]
+        if len(feeds) == 0:
+            return []
+        self.tokens -= len(feeds)
+        return self.refresher.refresh(feeds, self.on_feed_done)
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print('---', e, '---')
+            self.stopped.wait(self.tick)
+
+    def stop(self):
+        '''
+        Stop polling and interrupt the refresh in progress. Join the thread
+        afterwards to wait until it no longer uses the database.
+        '''
+        self.stopped.set()
+        self.refresher.stop()
@@ -29,8 +29,8 @@ except Exception as e:
     print(e)
     exit(-1)
 from gi.repository import Gtk
-from gi.repository import GdkPixbuf
-from .utils import get_pixbuf_from_base64string
+from .utils import get_pixbuf_from_image
+from .itunes import get_search_images
 from . import comun
 from .comun import _
 
@@ -63,9 +63,8 @@ class PodcastFoundRow(Gtk.ListBoxRow):
 
     def set_data(self, data):
         self.data = data
-        pixbuf = get_pixbuf_from_base64string(data['image']).scale_simple(
-            64, 64, GdkPixbuf.InterpType.BILINEAR)
-        self.image.set_from_pixbuf(pixbuf)
+        self.image.set_from_pixbuf(get_pixbuf_from_image(
+            data['image_hash'], 64, get_search_images()))
         if len(data['name']) > 50:
             name = data['name'][:47] + '...'
         else:
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# httpclient.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from . import comun
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+POOL_HOSTS = 32
+POOL_SIZE_PER_HOST = 4
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+HEADERS = {'User-Agent': '{0}/{1}'.format(comun.APPNAME, comun.VERSION),
+           'Accept-Encoding': 'gzip, deflate'}
+
+lock = threading.Lock()
+session = None
+
+
+def create_retry():
+    kwargs = {'total': RETRIES,
+              'backoff_factor': BACKOFF_FACTOR,
+              'status_forcelist': (429, 500, 502, 503, 504),
+              'raise_on_status': False}
+    try:
+        return Retry(allowed_methods=('GET', 'HEAD'), **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=('GET', 'HEAD'), **kwargs)
+
+
+def create_session():
+    retry = create_retry()
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS,
+                          pool_maxsize=POOL_SIZE_PER_HOST,
+                          max_retries=retry)
+    asession = requests.Session()
+    asession.headers.update(HEADERS)
+    asession.mount('http://', adapter)
+    asession.mount('https://', adapter)
+    return asession
+
+
+def get_session():
+    '''
+    The session shared by every thread, so requests to the same host reuse
+    its keep-alive connections.
+    '''
+    global session
+    with lock:
+        if session is None:
+            session = create_session()
+        return session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return get_session().get(url, **kwargs)
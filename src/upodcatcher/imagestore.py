@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# imagestore.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import time
+import hashlib
+from PIL import Image
+from . import comun
+from . import httpclient
+
+MAX_SIZE = 128
+# Seconds an image is kept by sweep even if nothing refers to it yet, so
+# one just stored for a feed being added is not swept before the feed is
+# saved
+SWEEP_GRACE = 60 * 60
+
+
+class ImageStore():
+    '''
+    Artwork on disk, one png per distinct image named by the sha1 of its
+    bytes, so feeds sharing the same artwork share the file. Smaller sizes
+    are made on first request and kept next to the original.
+    '''
+    def __init__(self, directory=comun.IMAGES_DIR):
+        self.directory = directory
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def get_filename(self, image_hash, size=None):
+        if size is None or size >= MAX_SIZE:
+            name = image_hash + '.png'
+        else:
+            name = '{0}_{1}.png'.format(image_hash, size)
+        return os.path.join(self.directory, image_hash[:2], name)
+
+    def put(self, data):
+        '''
+        Store the image (any format PIL reads) as a png of at most MAX_SIZE
+        pixels and return its hash.
+        '''
+        image = Image.open(io.BytesIO(data))
+        image.thumbnail((MAX_SIZE, MAX_SIZE), Image.LANCZOS)
+        png = io.BytesIO()
+        image.save(png, 'png')
+        png = png.getvalue()
+        image_hash = hashlib.sha1(png).hexdigest()
+        filename = self.get_filename(image_hash)
+        if not os.path.exists(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename + '.tmp', 'wb') as f:
+                f.write(png)
+            os.replace(filename + '.tmp', filename)
+        return image_hash
+
+    def download(self, url):
+        '''
+        Download and store the image at url, returning its hash or None.
+        '''
+        try:
+            r = httpclient.get(url, verify=False)
+            if r.status_code == 200:
+                return self.put(r.content)
+        except Exception as e:
+            print('---', e, '---')
+        return None
+
+    def get(self, image_hash, size=None):
+        '''
+        Return the filename of the image at size x size pixels at most, or
+        None when the image is not in the store.
+        '''
+        filename = self.get_filename(image_hash)
+        if not os.path.exists(filename):
+            return None
+        sized_filename = self.get_filename(image_hash, size)
+        if not os.path.exists(sized_filename):
+            try:
+                image = Image.open(filename)
+                image.thumbnail((size, size), Image.LANCZOS)
+                image.save(sized_filename + '.tmp', 'png')
+                os.replace(sized_filename + '.tmp', sized_filename)
+            except OSError as e:
+                print('---', e, '---')
+                return filename
+        return sized_filename
+
+    def sweep(self, keep, grace=SWEEP_GRACE):
+        '''
+        Remove the images, and their smaller sizes, whose hash is not in
+        keep and that were stored more than grace seconds ago. Returns the
+        number of files removed.
+        '''
+        removed = 0
+        limit = time.time() - grace
+        for directory in os.scandir(self.directory):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                image_hash = entry.name.split('.')[0].split('_')[0]
+                if image_hash in keep:
+                    continue
+                try:
+                    if entry.stat().st_mtime < limit:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError as e:
+                    print('---', e, '---')
+        return removed
@@ -21,24 +21,46 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import requests
 import locale
+import tempfile
+import threading
 from urllib.parse import urljoin
 from .upod_classes import Feed
-from .dbmanager import create_base64
+from .imagestore import ImageStore
+from . import httpclient
 
 BASE_URL = 'http://itunes.apple.com/'
 GENRES_PATH = '/WebObjects/MZStoreServices.woa/ws/genres'
 LOOKUP_PATH = '/lookup'
 SEARCH_PATH = '/search'
 
+lock = threading.Lock()
+# The directory is removed when the TemporaryDirectory is collected
+search_images_directory = None
+search_images = None
+
+
+def get_search_images():
+    '''
+    The store for the artwork of the search results, a temporary directory
+    removed when the application quits, as only the feeds added keep
+    theirs.
+    '''
+    global search_images, search_images_directory
+    with lock:
+        if search_images is None:
+            search_images_directory = tempfile.TemporaryDirectory(
+                prefix='upodcatcher-')
+            search_images = ImageStore(search_images_directory.name)
+        return search_images
+
 
 class PodcastClient(object):
 
     def __init__(self):
         self.__base_url = BASE_URL
         self.__timeout = 5
-        self.__session = requests.Session()
+        self.__session = httpclient.get_session()
         self.__genres = {}
 
     def search(self, term, media=None, entity=None, attribute=None, limit=None,
@@ -67,7 +89,9 @@ class PodcastClient(object):
                     feed['id'] = index
                     feed['url'] = element['feedUrl']
                     feed['name'] = element['trackName']
-                    feed['image'] = create_base64(element['artworkUrl100'])
+                    feed['image_url'] = element['artworkUrl100']
+                    feed['image_hash'] = get_search_images().download(
+                        feed['image_url'])
                     feed['norder'] = index
                     result.append(feed)
                 except Exception as e:
@@ -38,8 +38,9 @@ from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import GdkPixbuf
 import time
-from .utils import get_pixbuf_from_base64string
+from .utils import get_pixbuf_from_image
 from . import comun
+from .comun import _
 
 PLAY = GdkPixbuf.Pixbuf.new_from_file_at_size(comun.PLAY_ICON, 32, 32)
 INFO = GdkPixbuf.Pixbuf.new_from_file_at_size(comun.INFO_ICON, 16, 16)
@@ -55,6 +56,25 @@ NOLISTENED = GdkPixbuf.Pixbuf.new_from_file_at_size(
     comun.NOLISTENED_ICON, 16, 16)
 
 
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '{0:.0f} {1}'.format(size, unit)
+        size /= 1024.0
+    return '{0:.1f} GB'.format(size)
+
+
+def get_progress_text(received, total, rate, eta):
+    ans = [format_size(received)]
+    if total is not None:
+        ans[0] += ' / ' + format_size(total)
+    ans.append(format_size(rate) + '/s')
+    if eta is not None:
+        ans.append(time.strftime('%H:%M:%S', time.gmtime(eta)) + ' ' +
+                   _('left'))
+    return ' - '.join(ans)
+
+
 class ListBoxRowWithData(Gtk.ListBoxRow):
     __gsignals__ = {
         'button_play_pause_clicked': (GObject.SIGNAL_RUN_FIRST,
@@ -199,6 +219,26 @@ class ListBoxRowWithData(Gtk.ListBoxRow):
                     self.play_pause.set_from_pixbuf(PLAY)
             else:
                 self.play_pause.set_from_pixbuf(PLAY)
+            # Back to the playback position. set_position leaves the bar
+            # alone while the duration is unknown, as it is right after the
+            # first download, so it would keep the download progress.
+            self.progressbar.set_show_text(False)
+            self.set_position(self.data['position'])
+            if self.data['duration'] <= 0:
+                self.progressbar.set_fraction(0.0)
+
+    def set_download_progress(self, received, total, rate, eta):
+        '''
+        Show how far the download has got in the progress bar, which shows
+        the playback position otherwise.
+        '''
+        if total:
+            self.progressbar.set_fraction(min(1.0, float(received) / total))
+        else:
+            self.progressbar.pulse()
+        self.progressbar.set_text(get_progress_text(received, total, rate,
+                                                    eta))
+        self.progressbar.set_show_text(True)
 
     def set_downloaded(self, downloaded):
         self.is_downloaded = downloaded
@@ -250,9 +290,8 @@ class ListBoxRowWithData(Gtk.ListBoxRow):
 
     def set_data(self, data):
         self.data = data
-        pixbuf = get_pixbuf_from_base64string(data['feed_image']).scale_simple(
-            64, 64, GdkPixbuf.InterpType.BILINEAR)
-        self.image.set_from_pixbuf(pixbuf)
+        self.image.set_from_pixbuf(get_pixbuf_from_image(data['feed_image'],
+                                                         64))
         if len(data['feed_name']) > 35:
             feed_name = data['feed_name'][:32] + '...'
         else:
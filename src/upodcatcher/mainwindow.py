@@ -41,10 +41,10 @@ from gi.repository import GObject
 from gi.repository import GdkPixbuf
 from gi.repository import Notify
 import os
-import requests
 import mutagen
 from urllib.parse import urlparse
 from . import comun
+from . import httpclient
 from .comun import _
 from .dbmanager import DBManager
 from .player import Player
@@ -56,11 +56,13 @@ from .addfeeddialog import AddFeedDialog
 from .searchfeeddialog import SearchFeedDialog
 from .itunes import PodcastClient
 from .foundpodcastsdialog import FoundPodcastsDDialog
-from .utils import get_pixbuf_from_base64string
+from .utils import get_pixbuf_from_image, get_image_filename
 from .opmlparser import create_opml_from_urls, extract_rss_urls_from_opml
-from .listboxrowwithdata import ListBoxRowWithData
+from .listboxrowwithdata import ListBoxRowWithData, format_size
 from .showinfodialog import ShowInfoDialog
 from .downloadermanager import DownloaderManager
+from .feedrefresher import FeedRefresher
+from .feedscheduler import FeedScheduler
 from .newsvg import put_text
 
 CSS = '''
@@ -86,15 +88,6 @@ CSS = '''
 '''
 
 
-def get_thumbnail_filename_for_feed(feed_id, base64string):
-    thumbnail_filename = os.path.join(comun.THUMBNAILS_DIR,
-                                      'feed_{0}.png'.format(feed_id))
-    if not os.path.exists(thumbnail_filename):
-        pixbuf = get_pixbuf_from_base64string(base64string)
-        pixbuf.savev(thumbnail_filename, 'png', [], [])
-    return thumbnail_filename
-
-
 class MainWindow(Gtk.ApplicationWindow):
     __gsignals__ = {
         'text-changed': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE,
@@ -128,6 +121,7 @@ class MainWindow(Gtk.ApplicationWindow):
         self.object = None
         self.active_row = None
         self.updater = None
+        self.pages = None
         self.frame = 0
         self.pw = 0
 
@@ -175,6 +169,7 @@ class MainWindow(Gtk.ApplicationWindow):
                                    Gtk.PolicyType.AUTOMATIC)
         scrolledwindow2.set_shadow_type(Gtk.ShadowType.ETCHED_OUT)
         scrolledwindow2.set_visible(True)
+        scrolledwindow2.connect('edge-reached', self.on_trackview_edge_reached)
         self.stack.add_named(scrolledwindow2, 'tracks')
         self.stack.set_transition_type(Gtk.StackTransitionType.UNDER_DOWN)
 
@@ -210,23 +205,35 @@ class MainWindow(Gtk.ApplicationWindow):
         scrolledwindow2.add(self.trackview)
 
         self.db = DBManager(False)
+        # Artwork of removed feeds and of search results from older versions
+        self.db.sweep_images()
+        counters = self.db.get_feed_counters()
         for feed in self.db.get_feeds():
-            thumbnail = os.path.join(comun.THUMBNAILS_DIR,
-                                     'feed_{0}.png'.format(feed['id']))
-            pixbuf = get_pixbuf_from_base64string(feed['image'])
-            if not os.path.exists(thumbnail):
-                pixbuf.savev(thumbnail, 'png', [], [])
-            unlistened = self.db.get_unlistened_tracks_in_feed(feed['id'])
-            print(0, '---', unlistened)
+            pixbuf = get_pixbuf_from_image(feed['image_hash'])
+            unlistened = counters.get(feed['id'], {}).get('unlistened', 0)
 
             self.storefeeds.append([feed['id'],
                                     feed['url'],
                                     feed['title'],
-                                    feed['image'],
+                                    feed['image_hash'] or '',
                                     feed['norder'],
                                     put_text(pixbuf, str(unlistened))])
 
         self.downloaderManager = DownloaderManager()
+        self.downloaderManager.connect('started',
+                                       self.on_row_download_started)
+        self.downloaderManager.connect('ended', self.on_row_download_ended)
+        self.downloaderManager.connect('failed', self.on_row_download_failed)
+        self.downloaderManager.connect('progress',
+                                       self.on_row_download_progress)
+        self.downloaderManager.connect('throughput',
+                                       self.on_download_throughput)
+
+        self.scheduler = FeedScheduler(
+            self.db,
+            on_feed_done=lambda *result: GLib.idle_add(self.on_feed_updated,
+                                                       *result))
+        self.scheduler.start()
 
         self.load_css()
         self.show_all()
@@ -325,6 +332,17 @@ class MainWindow(Gtk.ApplicationWindow):
             self.db.set_track_no_downloaded(row.data['id'])
             row.data['filename'] = ''
 
+    def on_row_download_progress(self, widget, row, received, total, rate,
+                                 eta):
+        row.set_download_progress(received, total, rate, eta)
+
+    def on_download_throughput(self, widget, rate, downloads):
+        if downloads > 0:
+            self.hb.set_subtitle('{0}: {1} - {2}/s'.format(
+                _('Downloads'), downloads, format_size(rate)))
+        else:
+            self.hb.set_subtitle(None)
+
     def on_row_download_failed(self, widget, row):
         row.set_downloading(False)
         row.set_downloaded(False)
@@ -345,12 +363,6 @@ class MainWindow(Gtk.ApplicationWindow):
                 row.set_downloaded(False)
         else:
             self.downloaderManager.add(row)
-            self.downloaderManager.connect('started',
-                                           self.on_row_download_started)
-            self.downloaderManager.connect('ended',
-                                           self.on_row_download_ended)
-            self.downloaderManager.connect('failed',
-                                           self.on_row_download_failed)
 
     def on_row_listened(self, widget, row):
         listened = not (row.data['listened'] == 1)
@@ -385,6 +397,7 @@ class MainWindow(Gtk.ApplicationWindow):
             self.control['play-pause'].set_tooltip_text(_('Play'))
             self.db.set_track_position(self.active_row.data['id'],
                                        self.active_row.data['position'])
+            self.db.flush()
         self.active_row = row
         if self.active_row.is_playing is False:
             self.player.set_filename(
@@ -411,10 +424,8 @@ class MainWindow(Gtk.ApplicationWindow):
             artists = [self.active_row.data['feed_name']]
             album = self.active_row.data['feed_name']
             title = self.active_row.data['title']
-            feed_id = self.active_row.data['feed_id']
-            feed_image = self.active_row.data['feed_image']
-            album_art = 'file://' + get_thumbnail_filename_for_feed(feed_id,
-                                                                    feed_image)
+            album_art = 'file://' + get_image_filename(
+                self.active_row.data['feed_image'])
             self.sound_menu.song_changed(artists, album, title, album_art)
             self.sound_menu.signal_playing()
 
@@ -435,10 +446,8 @@ class MainWindow(Gtk.ApplicationWindow):
             artists = [self.active_row.data['feed_name']]
             album = self.active_row.data['feed_name']
             title = self.active_row.data['title']
-            feed_id = self.active_row.data['feed_id']
-            feed_image = self.active_row.data['feed_image']
-            album_art = 'file://' + get_thumbnail_filename_for_feed(feed_id,
-                                                                    feed_image)
+            album_art = 'file://' + get_image_filename(
+                self.active_row.data['feed_image'])
             self.sound_menu.song_changed(artists, album, title, album_art)
             self.sound_menu.signal_paused()
 
@@ -451,6 +460,7 @@ class MainWindow(Gtk.ApplicationWindow):
             self.active_row.set_playing(False)
             self.db.set_track_position(self.active_row.data['id'],
                                        self.active_row.data['position'])
+            self.db.flush()
 
     def on_iconview_actived(self, widget, index):
         model = widget.get_model()
@@ -460,14 +470,8 @@ class MainWindow(Gtk.ApplicationWindow):
         for awidget in self.trackview.get_children():
             self.trackview.remove(awidget)
         # self.db.add_tracks(id)
-        for index, track in enumerate(self.db.get_tracks_from_feed(id)):
-            row = ListBoxRowWithData(track, index)
-            row.connect('button_play_pause_clicked', self.on_row_play, row)
-            row.connect('button_info_clicked', self.on_row_info, row)
-            row.connect('button_listened_clicked', self.on_row_listened, row)
-            row.connect('button_download_clicked', self.on_row_download, row)
-            row.show()
-            self.trackview.add(row)
+        self.pages = self.db.iter_tracks_from_feed(id)
+        self.add_next_page()
         widget.hide()
 
         self.get_root_window().set_cursor(
@@ -483,26 +487,54 @@ class MainWindow(Gtk.ApplicationWindow):
         self.trackview.select_row(row)
         self.trackview.handler_unblock_by_func(self.on_row_selected)
 
+    def add_next_page(self):
+        '''
+        Append the next page of tracks of the open feed to the track view,
+        returning False when there are no more.
+        '''
+        if self.pages is None:
+            return False
+        page = next(self.pages, None)
+        if page is None:
+            self.pages = None
+            return False
+        index = len(self.trackview.get_children())
+        for track in page:
+            row = ListBoxRowWithData(track, index)
+            row.connect('button_play_pause_clicked', self.on_row_play, row)
+            row.connect('button_info_clicked', self.on_row_info, row)
+            row.connect('button_listened_clicked', self.on_row_listened, row)
+            row.connect('button_download_clicked', self.on_row_download, row)
+            row.show()
+            self.trackview.add(row)
+            index += 1
+        return True
+
+    def on_trackview_edge_reached(self, widget, position):
+        if position == Gtk.PositionType.BOTTOM:
+            self.add_next_page()
+
+    def on_feed_updated(self, feed_id, new_tracks, unlistened, error):
+        for feed in self.storefeeds:
+            if feed[0] == feed_id:
+                pixbuf = get_pixbuf_from_image(feed[3])
+                feed[5] = put_text(pixbuf, str(unlistened))
+                break
+        return False
+
     def update_feeds(self):
         def on_update_feeds_done(results, error):
-            if error is None and len(results) > 0:
-                for aresult in results:
-                    print(aresult)
+            if error is not None:
+                print(error)
             self.refresh(None)
 
         @async_function(on_done=on_update_feeds_done)
         def do_update_feeds_in_thread():
             print('updating feeds')
-            results = []
-            for feed in self.storefeeds:
-                print(feed[0], feed[1])
-                id = feed[0]
-                unlistened = self.db.get_unlistened_tracks_in_feed(id)
-                print(0, '---', unlistened)
-                feed[5] = put_text(feed[5], str(unlistened))
-                print(1)
-                results.append([id, unlistened])
-            return results
+            refresher = FeedRefresher(self.db)
+            return refresher.refresh(
+                on_feed_done=lambda *result: GLib.idle_add(
+                    self.on_feed_updated, *result))
 
         do_update_feeds_in_thread()
 
@@ -539,10 +571,8 @@ class MainWindow(Gtk.ApplicationWindow):
             print('updating....', id)
             result = None
             last_track = self.db.get_last_track_from_feed(id)
-            last_feed_track = self.db.get_last_track_date(id)
-            if last_track['date'] is None or\
-                    last_feed_track > last_track['date']:
-                self.db.add_tracks(id, last_track['date'])
+            sync = self.db.sync_feed(id)
+            if sync['inserted'] > 0:
                 result = (id, last_track['date'])
             return result
 
@@ -561,6 +591,7 @@ class MainWindow(Gtk.ApplicationWindow):
         self.play_controls.set_visible(False)
         self.feed_controls.set_visible(True)
         self.object = None
+        self.pages = None
 
     def _sound_menu_is_playing(self):
         return self.player.status == Status.PLAYING
@@ -659,6 +690,8 @@ class MainWindow(Gtk.ApplicationWindow):
                         self.active_row.data['id'])
                     self.active_row.set_listened(True)
                 self.active_row.set_position(position)
+                self.db.set_track_position(self.active_row.data['id'],
+                                           position)
 
                 self.control['position'].handler_block_by_func(
                     self.on_position_button_changed)
@@ -751,6 +784,7 @@ class MainWindow(Gtk.ApplicationWindow):
         hb.set_show_close_button(True)
         hb.props.title = comun.APPNAME
         self.set_titlebar(hb)
+        self.hb = hb
 
         self.play_controls = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 5)
         hb.pack_start(self.play_controls)
@@ -1043,14 +1077,11 @@ class MainWindow(Gtk.ApplicationWindow):
     def add_feed(self, url):
         def on_add_feed_done(result, error):
             if result is not None:
-                thumbnail = os.path.join(comun.THUMBNAILS_DIR,
-                                         'feed_{0}.png'.format(result['id']))
-                pixbuf = get_pixbuf_from_base64string(result['image'])
-                pixbuf.savev(thumbnail, 'png', [], [])
+                pixbuf = get_pixbuf_from_image(result['image_hash'])
                 self.storefeeds.append([result['id'],
                                         result['url'],
                                         result['title'],
-                                        result['image'],
+                                        result['image_hash'] or '',
                                         result['norder'],
                                         pixbuf])
             self.get_root_window().set_cursor(
@@ -1058,7 +1089,7 @@ class MainWindow(Gtk.ApplicationWindow):
 
         @async_function(on_done=on_add_feed_done)
         def do_add_feed(url):
-            request = requests.get(url)
+            request = httpclient.get(url, verify=False)
             if request.status_code == 200:
                 id = self.db.add_feed(url)
                 if id is not None:
@@ -1066,7 +1097,7 @@ class MainWindow(Gtk.ApplicationWindow):
                     return feed
             return None
 
-        do_add_feed()
+        do_add_feed(url)
 
     def on_toggled(self, widget, arg):
         if widget.get_active() is True:
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# migrations.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# The schema version is stored in PRAGMA user_version. Migration N (1 based)
+# brings a database from version N - 1 to version N. Only append to
+# MIGRATIONS, never edit or reorder a migration that has been released.
+
+import base64
+import sqlite3
+from .imagestore import ImageStore
+
+FEEDS_NEW_COLUMNS = [('ETAG', 'TEXT'),
+                     ('LAST_MODIFIED', 'TEXT'),
+                     ('BODY_HASH', 'TEXT'),
+                     ('LAST_CHECKED', 'INTEGER')]
+FEEDS_IMAGE_COLUMNS = [('IMAGE_HASH', 'TEXT'),
+                       ('IMAGE_URL', 'TEXT')]
+
+
+def add_columns(cursor, table, new_columns):
+    cursor.execute('PRAGMA table_info({0})'.format(table))
+    columns = [column[1] for column in cursor.fetchall()]
+    for name, definition in new_columns:
+        if name not in columns:
+            cursor.execute('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+                table, name, definition))
+
+
+def add_feeds_columns(cursor):
+    add_columns(cursor, 'FEEDS', FEEDS_NEW_COLUMNS)
+
+
+def create_views(cursor):
+    '''
+    Recreate the views as the current SQLString defines them.
+    '''
+    from .dbmanager import SQLString
+    cursor.execute('DROP VIEW IF EXISTS TRACKS_FEED_VIEW')
+    cursor.execute('DROP VIEW IF EXISTS TRACKS_LIST_VIEW')
+    for statement in split_statements(SQLString):
+        if statement.upper().startswith('CREATE VIEW'):
+            cursor.execute(statement)
+
+
+def move_images_to_store(cursor):
+    '''
+    Move the base64 artwork out of FEEDS.IMAGE into the image store. The
+    database is vacuumed afterwards to give the space back.
+    '''
+    add_columns(cursor, 'FEEDS', FEEDS_IMAGE_COLUMNS)
+    images = ImageStore()
+    cursor.execute('SELECT ID, IMAGE FROM FEEDS WHERE IMAGE IS NOT NULL')
+    for feed_id, image in cursor.fetchall():
+        try:
+            image_hash = images.put(base64.b64decode(image.encode()))
+        except Exception as e:
+            print('---', e, '---')
+            image_hash = None
+        cursor.execute('''UPDATE FEEDS SET IMAGE_HASH=?, IMAGE=NULL
+ WHERE ID=?''', (image_hash, feed_id))
+    create_views(cursor)
+    return True
+
+
+MIGRATIONS = [
+    add_feeds_columns,
+    '''
+CREATE INDEX IF NOT EXISTS TRACKS_FEED_DATE_INDEX ON TRACKS (FEED_ID, DATE);
+CREATE INDEX IF NOT EXISTS TRACKS_FEED_LISTENED_INDEX
+    ON TRACKS (FEED_ID, LISTENED);
+CREATE INDEX IF NOT EXISTS TRACKS_NORDER_INDEX ON TRACKS (NORDER);
+CREATE INDEX IF NOT EXISTS LIST_LIST_NORDER_INDEX ON LIST (LIST_ID, NORDER);
+''',
+    '''
+CREATE TABLE IF NOT EXISTS FEED_COUNTERS (
+    FEED_ID INTEGER PRIMARY KEY NOT NULL,
+    TOTAL INTEGER NOT NULL DEFAULT 0,
+    UNLISTENED INTEGER NOT NULL DEFAULT 0,
+    DOWNLOADED INTEGER NOT NULL DEFAULT 0);
+INSERT OR REPLACE INTO FEED_COUNTERS (FEED_ID, TOTAL, UNLISTENED, DOWNLOADED)
+    SELECT FEEDS.ID, COUNT(TRACKS.ID),
+           COUNT(CASE WHEN TRACKS.LISTENED=0 THEN 1 END),
+           COUNT(CASE WHEN TRACKS.DOWNLOADED!=0 THEN 1 END)
+      FROM FEEDS
+      LEFT JOIN TRACKS ON TRACKS.FEED_ID = FEEDS.ID
+      GROUP BY FEEDS.ID;
+CREATE TRIGGER IF NOT EXISTS FEEDS_COUNTERS_INSERT AFTER INSERT ON FEEDS
+BEGIN
+    INSERT OR IGNORE INTO FEED_COUNTERS (FEED_ID) VALUES (NEW.ID);
+END;
+CREATE TRIGGER IF NOT EXISTS FEEDS_COUNTERS_DELETE AFTER DELETE ON FEEDS
+BEGIN
+    DELETE FROM FEED_COUNTERS WHERE FEED_ID=OLD.ID;
+END;
+CREATE TRIGGER IF NOT EXISTS TRACKS_COUNTERS_INSERT AFTER INSERT ON TRACKS
+BEGIN
+    UPDATE FEED_COUNTERS SET
+        TOTAL=TOTAL + 1,
+        UNLISTENED=UNLISTENED + (NEW.LISTENED=0),
+        DOWNLOADED=DOWNLOADED + (NEW.DOWNLOADED!=0)
+    WHERE FEED_ID=NEW.FEED_ID;
+END;
+CREATE TRIGGER IF NOT EXISTS TRACKS_COUNTERS_DELETE AFTER DELETE ON TRACKS
+BEGIN
+    UPDATE FEED_COUNTERS SET
+        TOTAL=TOTAL - 1,
+        UNLISTENED=UNLISTENED - (OLD.LISTENED=0),
+        DOWNLOADED=DOWNLOADED - (OLD.DOWNLOADED!=0)
+    WHERE FEED_ID=OLD.FEED_ID;
+END;
+CREATE TRIGGER IF NOT EXISTS TRACKS_COUNTERS_UPDATE
+    AFTER UPDATE OF FEED_ID, LISTENED, DOWNLOADED ON TRACKS
+BEGIN
+    UPDATE FEED_COUNTERS SET
+        TOTAL=TOTAL - 1,
+        UNLISTENED=UNLISTENED - (OLD.LISTENED=0),
+        DOWNLOADED=DOWNLOADED - (OLD.DOWNLOADED!=0)
+    WHERE FEED_ID=OLD.FEED_ID;
+    UPDATE FEED_COUNTERS SET
+        TOTAL=TOTAL + 1,
+        UNLISTENED=UNLISTENED + (NEW.LISTENED=0),
+        DOWNLOADED=DOWNLOADED + (NEW.DOWNLOADED!=0)
+    WHERE FEED_ID=NEW.FEED_ID;
+END;
+''',
+    move_images_to_store,
+    '''
+CREATE VIRTUAL TABLE IF NOT EXISTS TRACKS_FTS USING fts5(
+    TITLE, DESCRIPTION, FEED_TITLE, tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3');
+INSERT INTO TRACKS_FTS(TRACKS_FTS, rank) VALUES('rank', 'bm25(4.0, 1.0, 2.0)');
+DELETE FROM TRACKS_FTS;
+INSERT INTO TRACKS_FTS(rowid, TITLE, DESCRIPTION, FEED_TITLE)
+    SELECT TRACKS.ID, TRACKS.TITLE, TRACKS.DESCRIPTION, FEEDS.TITLE
+      FROM TRACKS
+      LEFT JOIN FEEDS ON TRACKS.FEED_ID = FEEDS.ID;
+CREATE TRIGGER IF NOT EXISTS TRACKS_FTS_INSERT AFTER INSERT ON TRACKS
+BEGIN
+    INSERT INTO TRACKS_FTS(rowid, TITLE, DESCRIPTION, FEED_TITLE)
+        VALUES (NEW.ID, NEW.TITLE, NEW.DESCRIPTION,
+                (SELECT TITLE FROM FEEDS WHERE ID=NEW.FEED_ID));
+END;
+CREATE TRIGGER IF NOT EXISTS TRACKS_FTS_DELETE AFTER DELETE ON TRACKS
+BEGIN
+    DELETE FROM TRACKS_FTS WHERE rowid=OLD.ID;
+END;
+CREATE TRIGGER IF NOT EXISTS TRACKS_FTS_UPDATE
+    AFTER UPDATE OF TITLE, DESCRIPTION, FEED_ID ON TRACKS
+BEGIN
+    UPDATE TRACKS_FTS SET
+        TITLE=NEW.TITLE,
+        DESCRIPTION=NEW.DESCRIPTION,
+        FEED_TITLE=(SELECT TITLE FROM FEEDS WHERE ID=NEW.FEED_ID)
+    WHERE rowid=NEW.ID;
+END;
+CREATE TRIGGER IF NOT EXISTS FEEDS_FTS_UPDATE AFTER UPDATE OF TITLE ON FEEDS
+BEGIN
+    UPDATE TRACKS_FTS SET FEED_TITLE=NEW.TITLE
+    WHERE rowid IN (SELECT ID FROM TRACKS WHERE FEED_ID=NEW.ID);
+END;
+''',
+]
+
+# The hot queries and the plan details that must never appear for them
+QUERY_PLANS = [
+    ('''SELECT * FROM TRACKS_FEED_VIEW WHERE FEED_ID=? ORDER BY DATE DESC''',
+     (1,), ('SCAN TRACKS', 'TEMP B-TREE')),
+    ('''SELECT * FROM TRACKS_FEED_VIEW WHERE FEED_ID=? AND DATE>?
+ORDER BY DATE DESC''', (1, ''), ('SCAN TRACKS', 'TEMP B-TREE')),
+    ('''SELECT * FROM TRACKS_FEED_VIEW WHERE FEED_ID=? ORDER BY DATE DESC
+LIMIT 1''', (1,), ('SCAN TRACKS', 'TEMP B-TREE')),
+    ('''SELECT UNLISTENED FROM FEED_COUNTERS WHERE FEED_ID=?''', (1,),
+     ('SCAN FEED_COUNTERS',)),
+    ('''SELECT IDEN, DATE, TITLE, URL, LINK, DESCRIPTION FROM TRACKS
+WHERE FEED_ID=?''', (1,), ('SCAN TRACKS',)),
+    ('''SELECT * FROM TRACKS_LIST_VIEW WHERE LIST_ID=?''', (1,),
+     ('SCAN LIST', 'TEMP B-TREE')),
+    ('''SELECT max(NORDER) FROM LIST WHERE LIST_ID=?''', (1,),
+     ('SCAN LIST',)),
+    ('''SELECT max(NORDER) FROM TRACKS''', (), ('SCAN TRACKS',)),
+    ('''SELECT ID FROM TRACKS_FEED_VIEW WHERE FEED_ID=? AND (DATE, ID) < (?, ?)
+ORDER BY DATE DESC, ID DESC LIMIT ?''', (1, '', 1, 100),
+     ('SCAN TRACKS', 'TEMP B-TREE')),
+    ('''SELECT ID FROM TRACKS_LIST_VIEW WHERE LIST_ID=?
+AND (NORDER, ID) > (?, ?)
+ORDER BY NORDER, ID LIMIT ?''', (1, 1, 1, 100),
+     ('SCAN LIST', 'TEMP B-TREE FOR ORDER BY')),
+]
+
+
+def get_user_version(db):
+    cursor = db.cursor()
+    cursor.execute('PRAGMA user_version')
+    version = cursor.fetchone()[0]
+    cursor.close()
+    return version
+
+
+def split_statements(script):
+    '''
+    Split an sql script in statements, keeping the trigger bodies whole.
+    '''
+    statements = []
+    statement = ''
+    for line in script.splitlines(True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ''
+    if statement.strip():
+        statements.append(statement.strip())
+    return statements
+
+
+def migrate(db):
+    '''
+    Apply the pending migrations in order, each one in its own transaction
+    together with the new user_version. A migration function returns True
+    to have the database vacuumed at the end. Returns the final version.
+    '''
+    version = get_user_version(db)
+    vacuum = False
+    for index, migration in enumerate(MIGRATIONS[version:], version + 1):
+        cursor = db.cursor()
+        try:
+            cursor.execute('BEGIN')
+            if callable(migration):
+                vacuum = migration(cursor) is True or vacuum
+            else:
+                for statement in split_statements(migration):
+                    cursor.execute(statement)
+            cursor.execute('PRAGMA user_version={0}'.format(index))
+            db.commit()
+            version = index
+        except Exception as e:
+            db.rollback()
+            print('---', 'migration', index, e, '---')
+            raise
+        finally:
+            cursor.close()
+    if vacuum:
+        db.execute('VACUUM')
+    return version
+
+
+def get_query_plan(db, sql, parameters=()):
+    cursor = db.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)
+    ans = [row[-1] for row in cursor.fetchall()]
+    cursor.close()
+    return ans
+
+
+def check_query_plans(db):
+    '''
+    Return the (sql, plan) pairs of the hot queries that fall back to a
+    full scan or a temporary sort, an empty list when all of them use
+    their indexes.
+    '''
+    ans = []
+    for sql, parameters, forbidden in QUERY_PLANS:
+        plan = get_query_plan(db, sql, parameters)
+        if any(word in detail for detail in plan for word in forbidden):
+            ans.append((sql, plan))
+    return ans
+
+
+if __name__ == '__main__':
+    from .dbmanager import SQLString
+    db = sqlite3.connect(':memory:')
+    db.executescript(SQLString)
+    assert migrate(db) == len(MIGRATIONS)
+    assert migrate(db) == len(MIGRATIONS)
+    bad_plans = check_query_plans(db)
+    for sql, plan in bad_plans:
+        print(sql, plan)
+    assert len(bad_plans) == 0
+    print('schema version', get_user_version(db), 'query plans ok')
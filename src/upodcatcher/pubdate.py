@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pubdate.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import datetime
+import functools
+from email.utils import parsedate_tz
+from dateutil.parser import parse
+
+FORMAT = '%Y%m%dT%H%M%S'
+CACHE_SIZE = 4096
+RFC822 = re.compile(r'^\s*(?:[A-Za-z]{3},?\s+)?\d{1,2}\s+[A-Za-z]{3}\s+'
+                    r'\d{2,4}\s+\d{1,2}:\d{2}(?::\d{2})?(?:\s+\S+)?\s*$')
+
+
+def parse_rfc822(published):
+    if RFC822.match(published) is None:
+        return None
+    ans = parsedate_tz(published)
+    if ans is None:
+        return None
+    return datetime.datetime(*ans[:6])
+
+
+def parse_iso8601(published):
+    # Python < 3.7 has no fromisoformat, those dates go to dateutil
+    if not hasattr(datetime.datetime, 'fromisoformat'):
+        return None
+    return datetime.datetime.fromisoformat(published)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse_published(published):
+    for parser in (parse_rfc822, parse_iso8601):
+        try:
+            ans = parser(published)
+            if ans is not None:
+                return ans.strftime(FORMAT)
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return None
+
+
+def normalize_date(published, published_parsed=None):
+    '''
+    Return the publication date of an entry as stored in TRACKS.DATE (the
+    wall clock time of the feed, without time zone). The string is tried
+    with the RFC 822 and ISO 8601 parsers first, then the struct parsed by
+    feedparser, and only then dateutil. Raises ValueError when the date
+    can't be parsed.
+    '''
+    if published:
+        ans = parse_published(published)
+        if ans is not None:
+            return ans
+    if published_parsed is not None:
+        # feedparser converts to UTC, so this is only a fallback
+        return datetime.datetime(*published_parsed[:6]).strftime(FORMAT)
+    if not published:
+        raise ValueError('entry without date')
+    return parse_with_dateutil(published)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse_with_dateutil(published):
+    return parse(published).strftime(FORMAT)
+
+
+if __name__ == '__main__':
+    for published in ('Wed, 19 Jul 2017 02:40:00 -0000',
+                      'Wed, 19 Jul 2017 02:40:00 +0200',
+                      '19 Jul 2017 02:40 GMT',
+                      '2017-07-19T02:40:00Z',
+                      '2017-07-19T02:40:00+02:00',
+                      '2017-07-19',
+                      'July 19, 2017 2:40 pm',
+                      'Wed, 19 Jul 17 14:40:00 EST'):
+        print(published, normalize_date(published),
+              parse(published).strftime(FORMAT))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ratelimiter.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Bandwidth limits shared by every thread. All the traffic goes through the
+# global bucket, the background traffic (automatic downloads and feed
+# fetches) through the background bucket too, so it can be held to a
+# fraction of the global limit.
+
+import time
+import threading
+
+# Longest sleep before checking again whether the limit has changed
+MAX_WAIT = 0.5
+CHUNK_SIZE = 64 * 1024
+
+
+class TokenBucket():
+    '''
+    Token bucket of rate bytes per second holding up to burst bytes, or
+    unlimited when rate is None or not positive. consume always takes the tokens, going
+    into debt when there are not enough, and sleeps until the debt is paid,
+    so the threads sharing the bucket get their bytes in turn.
+    '''
+    def __init__(self, rate=None, burst=None):
+        self.lock = threading.Lock()
+        self.rate = None
+        self.burst = 0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        '''
+        Change the rate, one second worth of bytes of burst by default. The
+        threads waiting on the bucket pick it up within MAX_WAIT seconds.
+        '''
+        if rate is not None and rate <= 0:
+            rate = None
+        with self.lock:
+            self.refill()
+            self.rate = rate
+            if rate is None:
+                self.burst = 0
+                self.tokens = 0.0
+            else:
+                self.burst = burst if burst is not None else rate
+                self.tokens = min(self.tokens, self.burst)
+
+    def refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (
+                now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount):
+        with self.lock:
+            if self.rate is None:
+                return
+            self.refill()
+            self.tokens -= amount
+        while True:
+            with self.lock:
+                if self.rate is None:
+                    return
+                self.refill()
+                if self.tokens >= 0:
+                    return
+                wait = -self.tokens / self.rate
+            time.sleep(min(wait, MAX_WAIT))
+
+
+global_bucket = TokenBucket()
+background_bucket = TokenBucket()
+
+
+def set_limits(global_rate=None, background_rate=None):
+    '''
+    Limit all the traffic to global_rate and the background traffic to
+    background_rate bytes per second, None or 0 for no limit.
+    '''
+    global_bucket.set_rate(global_rate)
+    background_bucket.set_rate(background_rate)
+
+
+def throttle(amount, background=False):
+    '''
+    Wait until amount bytes may be transferred.
+    '''
+    if background:
+        background_bucket.consume(amount)
+    global_bucket.consume(amount)
+
+
+def iter_content(response, chunk_size=CHUNK_SIZE, background=False):
+    '''
+    The body of a streamed requests response, chunk after chunk, at the
+    pace the limits allow.
+    '''
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if chunk:
+            throttle(len(chunk), background)
+            yield chunk
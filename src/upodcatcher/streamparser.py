@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# streamparser.py
+#
+# This file is part of upodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from xml.etree import ElementTree
+from .pubdate import normalize_date
+import feedparser
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+DCTERMS = '{http://purl.org/dc/terms/}'
+ITEM_TAGS = ('item', ATOM + 'entry')
+# The tags feedparser reads the published date of an entry from
+PUBLISHED_TAGS = {'item': ('pubDate', DCTERMS + 'issued'),
+                  ATOM + 'entry': (ATOM + 'published', DCTERMS + 'issued')}
+# The new items are parsed again inside an empty feed of the same kind
+WRAPPERS = {'item': (b'<rss version="2.0"><channel>',
+                     b'</channel></rss>'),
+            ATOM + 'entry': (b'<feed xmlns="http://www.w3.org/2005/Atom">',
+                             b'</feed>')}
+CHUNK_SIZE = 16384
+STOP_AFTER = 3
+
+
+class NotDateOrdered(Exception):
+    pass
+
+
+def get_entries(content):
+    '''
+    Parse the whole feed and extract the columns stored in TRACKS, parsing
+    each publication date only once.
+    '''
+    entries = []
+    if content is None:
+        return entries
+    for entry in feedparser.parse(content).entries:
+        try:
+            entries.append({
+                'iden': entry.id,
+                'date': normalize_date(entry.get('published'),
+                                       entry.get('published_parsed')),
+                'title': entry.title,
+                'url': entry.enclosures[0]['url'],
+                'link': entry.get('link', ''),
+                'description': entry.get('description', '')})
+        except (AttributeError, IndexError, KeyError, ValueError) as e:
+            print('---', e, '---')
+    return entries
+
+
+def get_published(element):
+    '''
+    The published date of an item as written in the feed, or None when it
+    has none, in which case get_entries drops it.
+    '''
+    for tag in PUBLISHED_TAGS[element.tag]:
+        child = element.find(tag)
+        if child is not None and child.text is not None and\
+                child.text.strip():
+            return child.text.strip()
+    return None
+
+
+def iter_items(content, chunk_size=CHUNK_SIZE):
+    '''
+    Yield the RSS items and Atom entries of the feed in document order,
+    parsing the document incrementally, so the caller can stop as soon as
+    it has enough. Each element is cleared once the caller is done with it.
+    '''
+    parser = ElementTree.XMLPullParser(events=('end',))
+    for start in range(0, len(content), chunk_size):
+        parser.feed(content[start:start + chunk_size])
+        for event, element in parser.read_events():
+            if element.tag in ITEM_TAGS:
+                yield element
+                element.clear()
+    parser.close()
+
+
+def get_new_entries(content, upperthan, stop_after=STOP_AFTER):
+    '''
+    Return the entries newer than upperthan, stopping once stop_after
+    consecutive entries at or before upperthan have been seen. Returns None
+    when the feed can't be streamed (not well formed, without RSS items nor
+    Atom entries, or not sorted by date from newest to oldest) and must be
+    fully parsed instead.
+
+    The new items are handed to get_entries, so they are sanitized and
+    normalized exactly as if the whole feed had been parsed.
+    '''
+    kind = None
+    items = []
+    old_entries = 0
+    last_date = None
+    try:
+        for element in iter_items(content):
+            kind = element.tag
+            published = get_published(element)
+            if published is None:
+                continue
+            date = normalize_date(published)
+            if last_date is not None and date > last_date:
+                raise NotDateOrdered(date)
+            last_date = date
+            if date > upperthan:
+                items.append(ElementTree.tostring(element))
+            else:
+                old_entries += 1
+                if old_entries >= stop_after:
+                    break
+    except (ElementTree.ParseError, NotDateOrdered, ValueError,
+            OverflowError) as e:
+        print('---', e, '---')
+        return None
+    if kind is None:
+        return None
+    if len(items) == 0:
+        return []
+    start, end = WRAPPERS[kind]
+    return [entry for entry in get_entries(start + b''.join(items) + end)
+            if entry['date'] > upperthan]
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# trackdownloader.py
+#
+# This file is part of uPodcatcher
+#
+# Copyright (C) 2017
+# Lorenzo Carbonell Cerezo <lorenzo.carbonell.cerezo@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import threading
+from urllib.parse import urlparse
+from . import comun
+from . import httpclient
+from . import ratelimiter
+
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.part.json'
+# Seconds between saves of the state of a download in progress
+SAVE_STATE_INTERVAL = 2
+# Reads start at MIN_CHUNK_SIZE and double while reading, waiting for the
+# rate limits and writing them takes less than half of READ_TIME seconds,
+# or halve when it takes longer, so a fast download is written in a few
+# large chunks and a slow or limited one still advances smoothly
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+READ_TIME = 0.25
+# Read buffers kept for the next downloads
+MAX_BUFFERS = 4
+# Seconds between two progress reports of a download
+PROGRESS_INTERVAL = 0.5
+# Weight of the last interval in the smoothed rate of the progress reports
+RATE_SMOOTHING = 0.3
+
+buffers = []
+buffers_lock = threading.Lock()
+
+
+class IncompleteDownloadError(IOError):
+    pass
+
+
+def get_track_filename(track):
+    path = urlparse(track['url']).path
+    extension = os.path.splitext(path)[1]
+    return 'podcast_{0}{1}'.format(track['id'], extension)
+
+
+def load_state(local_filename, url):
+    '''
+    Return the state of the partial download of url into local_filename,
+    with the partial file truncated to the bytes known to be on disk, or
+    None if there is nothing to resume.
+    '''
+    part_filename = local_filename + PART_SUFFIX
+    try:
+        with open(local_filename + STATE_SUFFIX, 'r') as f:
+            state = json.load(f)
+        if state['url'] != url:
+            return None
+        received = min(state['received'], os.path.getsize(part_filename))
+    except (OSError, ValueError, KeyError):
+        return None
+    with open(part_filename, 'r+b') as f:
+        f.truncate(received)
+    state['received'] = received
+    return state
+
+
+def save_state(local_filename, state):
+    state_filename = local_filename + STATE_SUFFIX
+    with open(state_filename + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_filename + '.tmp', state_filename)
+
+
+def remove_state(local_filename):
+    for filename in (local_filename + PART_SUFFIX,
+                     local_filename + STATE_SUFFIX):
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+class ProgressMeter():
+    '''
+    Turns the bytes received by a download into at most one call per
+    interval seconds of callback(received, total, rate, eta), with the rate
+    in bytes per second smoothed over the last intervals and the eta in
+    seconds, None while unknown.
+    '''
+    def __init__(self, callback, received=0, total=None,
+                 interval=PROGRESS_INTERVAL):
+        self.callback = callback
+        self.total = total
+        self.interval = interval
+        self.rate = None
+        self.received = received
+        self.reported = time.monotonic()
+
+    def update(self, received, force=False):
+        now = time.monotonic()
+        elapsed = now - self.reported
+        if elapsed < self.interval and not force:
+            return
+        if elapsed > 0:
+            rate = (received - self.received) / elapsed
+            if self.rate is None:
+                self.rate = rate
+            else:
+                self.rate += RATE_SMOOTHING * (rate - self.rate)
+        self.received = received
+        self.reported = now
+        eta = None
+        if self.total is not None and self.rate:
+            eta = max(0, self.total - received) / self.rate
+        self.callback(received, self.total, self.rate or 0.0, eta)
+
+
+def acquire_buffer():
+    with buffers_lock:
+        if len(buffers) > 0:
+            return buffers.pop()
+    return bytearray(MAX_CHUNK_SIZE)
+
+
+def release_buffer(buffer):
+    with buffers_lock:
+        if len(buffers) < MAX_BUFFERS:
+            buffers.append(buffer)
+
+
+def preallocate(f, offset, length):
+    '''
+    Reserve the disk space for the rest of the file, where the system and
+    the filesystem allow it, to keep the file in one piece.
+    '''
+    if length > 0 and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), offset, length)
+        except OSError:
+            pass
+
+
+def is_encoded(r):
+    '''
+    Whether the body of r comes compressed despite asking for identity.
+    '''
+    encoding = r.headers.get('Content-Encoding', '').strip().lower()
+    return encoding not in ('', 'identity')
+
+
+def write_response(r, f, state, on_state, background=False, meter=None):
+    '''
+    Write the body of the streamed response r to f, reading straight into
+    a reused buffer, and count the bytes in state['received']. on_state is
+    called every SAVE_STATE_INTERVAL seconds, after the data is on disk,
+    and meter, a ProgressMeter, is updated after every chunk. A compressed
+    body can't be read raw, it is decoded by requests in chunks of
+    MIN_CHUNK_SIZE instead.
+    '''
+    buffer = acquire_buffer()
+    view = memoryview(buffer)
+    chunk_size = MIN_CHUNK_SIZE
+    saved = time.monotonic()
+    chunks = r.iter_content(chunk_size=MIN_CHUNK_SIZE) if is_encoded(r)\
+        else None
+    try:
+        while True:
+            start = time.monotonic()
+            if chunks is None:
+                data = view[:r.raw.readinto(view[:chunk_size])]
+            else:
+                data = next(chunks, b'')
+            size = len(data)
+            if size == 0:
+                break
+            ratelimiter.throttle(size, background)
+            f.write(data)
+            state['received'] += size
+            if meter is not None:
+                meter.update(state['received'])
+            elapsed = time.monotonic() - start
+            if size == chunk_size and elapsed < READ_TIME / 2:
+                chunk_size = min(MAX_CHUNK_SIZE, chunk_size * 2)
+            elif elapsed > READ_TIME:
+                chunk_size = max(MIN_CHUNK_SIZE, chunk_size // 2)
+            if time.monotonic() - saved > SAVE_STATE_INTERVAL:
+                f.flush()
+                os.fsync(f.fileno())
+                on_state(state)
+                saved = time.monotonic()
+    finally:
+        view.release()
+        release_buffer(buffer)
+
+
+def parse_content_range(content_range):
+    '''
+    Return (first byte, total length) from a Content-Range header like
+    'bytes 100-199/200', total is None when the server sends '*'.
+    '''
+    unit, _, value = content_range.partition(' ')
+    byte_range, _, total = value.partition('/')
+    first = int(byte_range.partition('-')[0])
+    return first, None if total.strip() == '*' else int(total)
+
+
+def download_file(url, local_filename, background=False, on_progress=None):
+    '''
+    Download url into local_filename + PART_SUFFIX, saving the url, the
+    validator and the bytes received in a json sidecar as it goes. A later
+    call resumes from there with a Range request, made conditional with
+    If-Range so a changed file is downloaded again from the start. The
+    partial file is renamed to local_filename only when it is complete.
+    The transfer is held to the ratelimiter limits, to the background ones
+    too if background. on_progress, if given, gets the reports of a
+    ProgressMeter.
+    '''
+    part_filename = local_filename + PART_SUFFIX
+    state = load_state(local_filename, url)
+    headers = {'Accept-Encoding': 'identity'}
+    if state is not None and state['received'] > 0 and\
+            (state['etag'] or state['last_modified']):
+        headers['Range'] = 'bytes={0}-'.format(state['received'])
+        headers['If-Range'] = state['etag'] or state['last_modified']
+    r = httpclient.get(url, stream=True, headers=headers)
+    if r.status_code == 206 and is_encoded(r):
+        # A range of the compressed body can't be appended to the file
+        r.close()
+        remove_state(local_filename)
+        state = None
+        r = httpclient.get(url, stream=True,
+                           headers={'Accept-Encoding': 'identity'})
+    if r.status_code == 416 and state is not None and\
+            state['received'] == state['total']:
+        r.close()
+    else:
+        if r.status_code == 416:
+            # Nothing to resume from after all, start again next time
+            remove_state(local_filename)
+        r.raise_for_status()
+        received = 0
+        total = None
+        if r.status_code == 206:
+            received, total = parse_content_range(
+                r.headers.get('Content-Range', ''))
+            if state is None or received != state['received']:
+                remove_state(local_filename)
+                raise IncompleteDownloadError(
+                    'unexpected range from {0}'.format(url))
+        elif 'Content-Length' in r.headers and not is_encoded(r):
+            total = int(r.headers['Content-Length'])
+        etag = r.headers.get('ETag')
+        last_modified = r.headers.get('Last-Modified')
+        if etag is not None and etag.startswith('W/'):
+            # Weak validators can not be used in If-Range
+            etag = None
+        if is_encoded(r):
+            # The decoded bytes on disk are no range of the body, so this
+            # download can't be resumed
+            etag = None
+            last_modified = None
+        state = {'url': url,
+                 'etag': etag,
+                 'last_modified': last_modified,
+                 'received': received,
+                 'total': total}
+        save_state(local_filename, state)
+        meter = None
+        if on_progress is not None:
+            meter = ProgressMeter(on_progress, received, total)
+        with open(part_filename, 'r+b' if received > 0 else 'wb') as f:
+            if total is not None:
+                preallocate(f, received, total - received)
+            f.seek(received)
+            try:
+                write_response(r, f, state,
+                               lambda state: save_state(local_filename,
+                                                        state),
+                               background, meter)
+            finally:
+                f.flush()
+                os.fsync(f.fileno())
+                save_state(local_filename, state)
+                if meter is not None:
+                    meter.update(state['received'], force=True)
+    if state['total'] is not None and state['received'] != state['total']:
+        raise IncompleteDownloadError('{0} of {1} bytes from {2}'.format(
+            state['received'], state['total'], url))
+    os.replace(part_filename, local_filename)
+    os.remove(local_filename + STATE_SUFFIX)
+
+
+def download_track(track, background=False, on_progress=None):
+    filename = get_track_filename(track)
+    download_file(track['url'], os.path.join(comun.PODCASTS_DIR, filename),
+                  background, on_progress)
+    return filename
@@ -22,6 +22,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from collections.abc import MutableMapping
+
+
 class Base(dict):
 
     def __init__(self, data=None):
@@ -75,6 +78,12 @@ class Feed(Base):
         self['link'] = ''
         self['description'] = ''
         self['norder'] = -1
+        self['etag'] = None
+        self['last_modified'] = None
+        self['body_hash'] = None
+        self['last_checked'] = None
+        self['image_hash'] = None
+        self['image_url'] = None
 
     def set(self, data):
         self['id'] = data[0]
@@ -84,6 +93,12 @@ class Feed(Base):
         self['link'] = data[4]
         self['description'] = data[5]
         self['norder'] = data[6]
+        self['etag'] = data[7]
+        self['last_modified'] = data[8]
+        self['body_hash'] = data[9]
+        self['last_checked'] = data[10]
+        self['image_hash'] = data[11]
+        self['image_url'] = data[12]
 
 
 class List(Base):
@@ -152,6 +167,206 @@ class Track(Base):
         self['list_id'] = data[16]
 
 
+class TrackSummary(Track):
+    '''
+    The columns a row of the track view shows. The detail columns are not
+    loaded with the row but on first access, through loader, a function
+    that takes the track id and returns a dict with them.
+    '''
+    DETAIL = ('iden', 'link', 'description')
+
+    def __init__(self, data=None, loader=None):
+        self.loader = loader
+        Track.__init__(self, data)
+
+    def set(self, data):
+        self['id'] = data[0]
+        self['feed_id'] = data[1]
+        self['date'] = data[2]
+        self['title'] = data[3]
+        self['url'] = data[4]
+        self['duration'] = data[5]
+        self['position'] = data[6]
+        self['downloaded'] = data[7]
+        self['listened'] = data[8]
+        self['filename'] = data[9]
+        self['norder'] = data[10]
+        self['feed_name'] = data[11]
+        self['feed_image'] = data[12]
+        self['list_id'] = data[13] if len(data) > 13 else -1
+
+    def __missing__(self, key):
+        if key not in self.DETAIL or self.loader is None:
+            raise KeyError(key)
+        loader = self.loader
+        self.loader = None
+        self.update(loader(self['id']))
+        return self[key]
+
+
+class Record(MutableMapping):
+    '''
+    A row kept in slots instead of a dict. It reads and writes like the
+    dict based classes above, record['title'], so callers do not mind which
+    one they get. Only the keys in FIELDS exist and none can be deleted.
+    '''
+    __slots__ = ()
+    FIELDS = ()
+    KEYS = frozenset()
+
+    @classmethod
+    def row_factory(cls, *args):
+        '''
+        Return a sqlite3 row factory making a cls of every row, with args
+        passed after the row.
+        '''
+        def factory(cursor, row):
+            return cls(row, *args)
+        return factory
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            return self.__missing__(key)
+
+    def __missing__(self, key):
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError('record fields can not be deleted')
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __eq__(self, other):
+        return self.id == other['id']
+
+    def __ne__(self, other):
+        return self.id != other['id']
+
+    def __lt__(self, other):
+        return self.norder < other['norder']
+
+    def __le__(self, other):
+        return self.norder <= other['norder']
+
+    def __gt__(self, other):
+        return other['norder'] < self.norder
+
+    def __ge__(self, other):
+        return other['norder'] <= self.norder
+
+    def __str__(self):
+        ans = []
+        for key in self.keys():
+            ans.append('{0}: {1}\n'.format(key, self[key]))
+        return ''.join(ans)
+
+    def __repr__(self):
+        return '{0}(id={1})'.format(type(self).__name__, self.id)
+
+
+class FeedRecord(Record):
+    '''
+    A row of FEEDS, the slotted counterpart of Feed.
+    '''
+    FIELDS = ('id', 'url', 'title', 'image', 'link', 'description', 'norder',
+              'etag', 'last_modified', 'body_hash', 'last_checked',
+              'image_hash', 'image_url')
+    __slots__ = FIELDS
+    KEYS = frozenset(FIELDS)
+    DEFAULTS = (-1, None, None, None, '', '', -1, None, None, None, None,
+                None, None)
+
+    def __init__(self, data=None):
+        (self.id, self.url, self.title, self.image, self.link,
+         self.description, self.norder, self.etag, self.last_modified,
+         self.body_hash, self.last_checked, self.image_hash,
+         self.image_url) = self.DEFAULTS if data is None else data
+
+
+class ListRecord(Record):
+    '''
+    A row of LISTS, the slotted counterpart of List.
+    '''
+    FIELDS = ('id', 'name', 'norder')
+    __slots__ = FIELDS
+    KEYS = frozenset(FIELDS)
+    DEFAULTS = (-1, None, -1)
+
+    def __init__(self, data=None):
+        self.id, self.name, self.norder = \
+            self.DEFAULTS if data is None else data
+
+
+class TrackRecord(Record):
+    '''
+    A row of TRACKS, TRACKS_FEED_VIEW or TRACKS_LIST_VIEW, the slotted
+    counterpart of Track. The columns a shorter row lacks keep their
+    defaults.
+    '''
+    FIELDS = ('id', 'feed_id', 'iden', 'date', 'title', 'url', 'link',
+              'description', 'duration', 'position', 'downloaded',
+              'listened', 'filename', 'norder', 'feed_name', 'feed_image',
+              'list_id')
+    __slots__ = FIELDS
+    KEYS = frozenset(FIELDS)
+    DEFAULTS = (-1, -1, None, None, None, None, '', '', -1, -1, 0, 0, None,
+                -1, None, None, -1)
+
+    def __init__(self, data=None):
+        if data is None:
+            data = self.DEFAULTS
+        elif len(data) < len(self.DEFAULTS):
+            data = tuple(data) + self.DEFAULTS[len(data):]
+        (self.id, self.feed_id, self.iden, self.date, self.title, self.url,
+         self.link, self.description, self.duration, self.position,
+         self.downloaded, self.listened, self.filename, self.norder,
+         self.feed_name, self.feed_image, self.list_id) = data
+
+
+class TrackSummaryRecord(TrackRecord):
+    '''
+    The slotted counterpart of TrackSummary, made from the
+    TRACK_SUMMARY_COLUMNS of a row plus, optionally, its LIST_ID. The
+    DETAIL fields are left unset until first read, when loader is called
+    with the track id to get them as a dict.
+    '''
+    FIELDS = TrackRecord.FIELDS + ('snippet',)
+    __slots__ = ('snippet', 'loader')
+    KEYS = frozenset(FIELDS)
+    DETAIL = TrackSummary.DETAIL
+
+    def __init__(self, data, loader=None):
+        self.loader = loader
+        self.snippet = None
+        (self.id, self.feed_id, self.date, self.title, self.url,
+         self.duration, self.position, self.downloaded, self.listened,
+         self.filename, self.norder, self.feed_name,
+         self.feed_image) = data[:13]
+        self.list_id = data[13] if len(data) > 13 else -1
+
+    def __missing__(self, key):
+        if key not in self.DETAIL or self.loader is None:
+            raise KeyError(key)
+        loader = self.loader
+        self.loader = None
+        for name, value in loader(self.id).items():
+            setattr(self, name, value)
+        return self[key]
+
+
 if __name__ == '__main__':
     feed1 = Feed()
     feed2 = Feed()
@@ -168,3 +383,14 @@ if __name__ == '__main__':
     print(alist)
     alist.sort()
     print(alist)
+    track = TrackSummaryRecord((7, 1, '20170101', 'Title', 'http://a', 0, 0,
+                                0, 0, None, 3, 'Feed', None),
+                               lambda id: {'iden': 'iden', 'link': '',
+                                           'description': 'Loaded'})
+    track['position'] = 12
+    assert track['position'] == 12 and track.get('list_id') == -1
+    assert track['description'] == 'Loaded' and track.loader is None
+    assert 'title' in track and 'name' not in track
+    assert track == Track((7,) + (None,) * 13)
+    assert dict(track)['feed_name'] == 'Feed'
+    print(track)
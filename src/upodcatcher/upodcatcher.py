@@ -38,6 +38,7 @@ from gi.repository import Gio
 from gi.repository import GLib
 from gi.repository import GdkPixbuf
 from gi.repository import Notify
+import signal
 import webbrowser
 from .mainwindow import MainWindow
 from . import comun
@@ -52,8 +53,13 @@ class MainApplication(Gtk.Application):
             flags=Gio.ApplicationFlags.FLAGS_NONE
         )
         self.license_type = Gtk.License.GPL_3_0
+        self.win = None
 
     def do_shutdown(self):
+        if self.win is not None:
+            self.win.scheduler.stop()
+            self.win.scheduler.join()
+            self.win.db.close()
         Gtk.Application.do_shutdown(self)
 
     def on_quit(self, widget, data):
@@ -185,6 +191,14 @@ class MainApplication(Gtk.Application):
         self.win = MainWindow(self)
         self.add_window(self.win)
         self.win.show()
+        if self.win.db.tracer is not None:
+            # kill -USR1 dumps the database trace of the running application
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1,
+                                 self.on_dump_trace)
+
+    def on_dump_trace(self):
+        print('database trace in', self.win.db.tracer.dump())
+        return True
 
     def action_clicked(self, action, variant):
         print(action, variant)
@@ -21,7 +21,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import requests
 import gi
 try:
     gi.require_version('GdkPixbuf', '2.0')
@@ -29,20 +28,19 @@ except Exception as e:
     print(e)
     exit(1)
 from gi.repository import GdkPixbuf
-import base64
 from . import comun
+from . import httpclient
+from . import trackdownloader
+from .imagestore import ImageStore
 
 NOIMAGE = GdkPixbuf.Pixbuf.new_from_file_at_size(comun.NOIMAGE_ICON, 128, 128)
+IMAGES = ImageStore()
+PIXBUFS = {}
 
 
 def download_file(url, local_filename):
-    # NOTE the stream=True parameter
     try:
-        r = requests.get(url, stream=True)
-        with open(local_filename, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
+        trackdownloader.download_file(url, local_filename)
         return True
     except Exception as e:
         print(e)
@@ -51,7 +49,7 @@ def download_file(url, local_filename):
 
 def read_remote_file(url):
     try:
-        r = requests.get(url, stream=True)
+        r = httpclient.get(url)
         if r.status_code == 200:
             return r.text
     except Exception as e:
@@ -73,12 +71,29 @@ def get_selected_value_in_combo(combo):
     return model.get_value(combo.get_active_iter(), 0)
 
 
-def get_pixbuf_from_base64string(base64string):
-    if base64string is None:
-        return NOIMAGE
-    raw_data = base64.b64decode(base64string.encode())
-    pixbuf_loader = GdkPixbuf.PixbufLoader.new_with_mime_type("image/png")
-    pixbuf_loader.write(raw_data)
-    pixbuf_loader.close()
-    pixbuf = pixbuf_loader.get_pixbuf()
-    return pixbuf
+def get_image_filename(image_hash, size=None, store=None):
+    if store is None:
+        store = IMAGES
+    if image_hash:
+        filename = store.get(image_hash, size)
+        if filename is not None:
+            return filename
+    return comun.NOIMAGE_ICON
+
+
+def get_pixbuf_from_image(image_hash, size=128, store=None):
+    '''
+    The artwork decoded at size pixels, once per image and size. The image
+    is looked up in store, the one of the feeds by default.
+    '''
+    if store is None:
+        store = IMAGES
+    key = (store.directory, image_hash, size)
+    if key not in PIXBUFS:
+        filename = get_image_filename(image_hash, size, store)
+        if filename == comun.NOIMAGE_ICON:
+            PIXBUFS[key] = NOIMAGE.scale_simple(
+                size, size, GdkPixbuf.InterpType.BILINEAR)
+        else:
+            PIXBUFS[key] = GdkPixbuf.Pixbuf.new_from_file(filename)
+    return PIXBUFS[key]